@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+CarrotServ.update_navi() tick benchmark. Runs on a PC: SubMaster/PubMaster are replaced by stubs.
+
+  python carrot_bench.py                      # print p50/p99/max latency and peak allocation per tick
+  python carrot_bench.py --save base.json     # store the result as a baseline
+  python carrot_bench.py --check base.json    # fail (exit 1) if p50/p99 regress more than --tolerance
+  python carrot_bench.py --envelope           # vectorized envelope_speed() vs the closed form calculate_current_speed()
+  python carrot_bench.py --turn               # update_auto_turn() with check_steer True/False
+  python carrot_bench.py --geo                # carrot_geo batched geodesy vs per-point math calls
+"""
+import argparse
+import io
+import json
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from openpilot.selfdrive.carrot.carrot_log import clog
+from openpilot.selfdrive.carrot.carrot_replay import ReplayClock, ReplayPubMaster, ReplaySubMaster, _StaticParamsWatcher
+
+GPS_SERVICE = "gpsLocationExternal"
+DT = 0.1   # carrot_man loop rate
+
+
+def _sm_state(v_ego, distance):
+  return {
+    "carState": [True, True, True, [v_ego, 0, 0, False, False, False, 0.0, 0.0]],
+    "carControl": [True, True, True, []],
+    "selfdriveState": [True, True, True, [distance]],
+    "navInstruction": [False, False, False, [0, 0, 0.0, 0.0, "", "", ""]],
+    "gps": [True, True, True, [True, 37.5, 127.0, 90.0, 5.0]],
+  }
+
+
+def _navi_packet(i, **kw):
+  packet = {
+    "carrotIndex": i, "nRoadLimitSpeed": 80, "nSdiType": -1, "nSdiSpeedLimit": 0, "nSdiDist": 0,
+    "nTBTDist": 0, "nTBTTurnType": -1, "nTBTDistNext": 0, "nTBTTurnTypeNext": -1,
+    "szTBTMainText": "", "szPosRoadName": "road", "vpPosPointLat": 37.5, "vpPosPointLon": 127.0,
+    "nPosAngle": 90.0, "roadcate": 6, "nGoPosDist": 12000, "nGoPosTime": 900,
+  }
+  packet.update(kw)
+  return packet
+
+
+def _route(n):
+  coords = [(i * 2.0, (i % 50) * 0.3) for i in range(n)]
+  return coords, [i * 2.0 for i in range(n)]
+
+
+# name -> (navi packet for tick i or None, naviPaths route length)
+SCENARIOS = {
+  "idle": (lambda i: None, 0),
+  "sdi_camera": (lambda i: _navi_packet(i, nSdiType=1, nSdiSpeedLimit=60, nSdiDist=max(600 - i, 10)), 0),
+  "tbt_turn_next": (lambda i: _navi_packet(i, nTBTTurnType=12, nTBTDist=max(400 - i, 10), nTBTTurnTypeNext=7,
+                                           nTBTDistNext=150, nTBTNextRoadWidth=7, szTBTMainText="turn"), 0),
+  "long_route": (lambda i: _navi_packet(i), 1000),
+  "detect_heavy": (lambda i: dict(_navi_packet(i), carrotCmd="DETECT", carrotArg=f"Red Light, 0.{i % 9}, 0.5, 0.8"), 0),
+  "detect_batch": (lambda i: dict(_navi_packet(i), carrotCmd="DETECT",
+                                  carrotArg=f"{i}|" + ";".join(f"Red Light,0.{k + 1},0.{i % 5 + 2},0.{k + 3}" for k in range(6))), 0),
+}
+
+
+def run_scenario(name, ticks=2000, warmup=100):
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ
+  from openpilot.selfdrive.carrot.carrot_phase import PhaseStore, TrafficPhasePredictor
+  make_packet, route_len = SCENARIOS[name]
+  serv = CarrotServ()
+  clock = ReplayClock()
+  serv.clock = clock
+  serv.traffic_phase = TrafficPhasePredictor(PhaseStore(":memory:"))
+  serv.params_watcher.stop()
+  serv.params_watcher = _StaticParamsWatcher()
+  serv.params_version = serv.params_watcher.version
+  sm, pm = ReplaySubMaster(GPS_SERVICE), ReplayPubMaster()
+  coords, distances = _route(route_len)
+
+  v_ego, distance = 16.0, 0.0
+  lat = []
+  alloc_bytes = []
+  for i in range(warmup + ticks):
+    clock.t = i * DT
+    distance += v_ego * DT
+    if i % 2 == 0:
+      packet = make_packet(i)
+      if packet is not None:
+        serv.update(packet)
+    sm.load(_sm_state(v_ego, distance))
+
+    measure = i >= warmup
+    if measure and i % 10 == 0:   # every 10th tick is traced for allocations, not timed
+      tracemalloc.start()
+      base = tracemalloc.get_traced_memory()[0]
+      serv.update_navi("127.0.0.1", sm, pm, 80.0, coords, distances, 70.0, GPS_SERVICE)
+      alloc_bytes.append(tracemalloc.get_traced_memory()[1] - base)
+      tracemalloc.stop()
+      continue
+    t0 = time.perf_counter()
+    serv.update_navi("127.0.0.1", sm, pm, 80.0, coords, distances, 70.0, GPS_SERVICE)
+    if measure:
+      lat.append(time.perf_counter() - t0)
+
+  serv.close()
+  lat.sort()
+  return {
+    "p50_us": lat[len(lat) // 2] * 1e6,
+    "p99_us": lat[int(len(lat) * 0.99)] * 1e6,
+    "max_us": lat[-1] * 1e6,
+    "alloc_peak_kb": sum(alloc_bytes) / max(1, len(alloc_bytes)) / 1024,
+  }
+
+
+def bench_envelope(n=20000):
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ
+  from openpilot.selfdrive.carrot.carrot_speed import envelope_speed
+  calc = CarrotServ.calculate_current_speed
+  configs = [(60 * 1.05, 6., 0.8), (35., 1., 0.8), (20., 2., 0.8)]   # cam, bump, turn
+  dists = np.random.default_rng(0).uniform(-20., 1500., 64)
+  queries = [(float(d), *configs[i % len(configs)]) for i, d in enumerate(dists)]
+
+  def closed():
+    for q in queries:
+      calc(None, *q)
+
+  d, v, t, a = (np.array(c) for c in zip(*queries, strict=True))
+  per = 1e6 / n / len(queries)
+  print(f"closed form   {timeit.timeit(closed, number=n) * per:6.3f}us/query")
+  print(f"vectorized    {timeit.timeit(lambda: envelope_speed(d, v, t, a), number=n) * per:6.3f}us/query  ({len(queries)} per call)")
+
+
+def bench_auto_turn(n=20000):
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ
+  serv = CarrotServ()
+  serv.params_watcher.stop()
+  serv.params_watcher = _StaticParamsWatcher()
+  serv.params_version = serv.params_watcher.version
+  serv.autoTurnMapChange = 0
+  serv.nRoadLimitSpeed, serv.nTBTNextRoadWidth = 60, 7
+  sm = ReplaySubMaster(GPS_SERVICE)
+  sm.load(_sm_state(16.0, 0.0))
+  cases = [(1, 300.0), (3, 120.0), (7, 500.0), (-1, 0.0)]   # turn prepare, fork, stop, none
+  for check_steer in (True, False):
+    def run():
+      for turn_info, dist in cases:
+        serv.update_auto_turn(57.6, sm, turn_info, dist, check_steer)
+    print(f"update_auto_turn check_steer={check_steer!s:5s} {timeit.timeit(run, number=n) * 1e6 / n / len(cases):6.3f}us/call")
+  serv.close()
+
+
+def bench_geo(n=10000, number=20):
+  import math
+  from openpilot.selfdrive.carrot import carrot_geo as geo
+  rng = np.random.default_rng(0)
+  lat1, lon1 = 37.5 + rng.uniform(-0.5, 0.5, n), 127.0 + rng.uniform(-0.5, 0.5, n)
+  lat2, lon2 = lat1 + rng.uniform(-0.05, 0.05, n), lon1 + rng.uniform(-0.05, 0.05, n)
+  dist, bearing = rng.uniform(0, 500, n), rng.uniform(0, 360, n)
+  points = list(zip(lat1.tolist(), lon1.tolist(), lat2.tolist(), lon2.tolist(), strict=True))
+  moves = list(zip(lat1.tolist(), lon1.tolist(), dist.tolist(), bearing.tolist(), strict=True))
+
+  def haversine_scalar():
+    out = []
+    for la1, lo1, la2, lo2 in points:
+      p1, p2 = math.radians(la1), math.radians(la2)
+      a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lo2 - lo1) / 2) ** 2
+      out.append(2 * geo.EARTH_RADIUS * math.asin(math.sqrt(a)))
+    return out
+
+  def destination_scalar():   # the old CarrotServ.estimate_position()
+    out = []
+    for la, lo, d, b in moves:
+      h = math.radians(b)
+      out.append((la + math.degrees(d * math.cos(h) / geo.EARTH_RADIUS),
+                  lo + math.degrees(d * math.sin(h) / (geo.EARTH_RADIUS * math.cos(math.radians(la))))))
+    return out
+
+  ref = np.array(haversine_scalar())
+  per = 1e9 / n / number
+  print(f"haversine   scalar {timeit.timeit(haversine_scalar, number=number) * per:7.1f}ns/pt")
+  for dtype in (np.float64, np.float32):
+    err = np.abs(geo.haversine(lat1, lon1, lat2, lon2, dtype=dtype) - ref).max()
+    t = timeit.timeit(lambda: geo.haversine(lat1, lon1, lat2, lon2, dtype=dtype), number=number) * per   # noqa: B023
+    print(f"haversine   {np.dtype(dtype).name:7s} {t:6.1f}ns/pt  (max err {err:.3f}m)")
+  t = timeit.timeit(lambda: geo.initial_bearing(lat1, lon1, lat2, lon2), number=number) * per
+  print(f"bearing     float64 {t:6.1f}ns/pt")
+  print(f"destination scalar {timeit.timeit(destination_scalar, number=number) * per:7.1f}ns/pt")
+  print(f"destination float64 {timeit.timeit(lambda: geo.destination(lat1, lon1, dist, bearing), number=number) * per:6.1f}ns/pt"
+        f"  great circle {timeit.timeit(lambda: geo.destination_point(lat1, lon1, dist, bearing), number=number) * per:6.1f}ns/pt")
+  t = timeit.timeit(lambda: geo.project(lat2, lon2, 37.5, 127.0, dtype=np.float32), number=number) * per
+  print(f"project     float32 {t:6.1f}ns/pt")
+
+  glat, glon = geo.wgs84_to_gcj02(lat1, lon1)
+  err = geo.haversine(lat1, lon1, *geo.gcj02_to_wgs84(glat, glon)).max()
+  scalar = list(zip(glat.tolist(), glon.tolist(), strict=True))
+  t = timeit.timeit(lambda: [geo.gcj02_to_wgs84(la, lo) for la, lo in scalar], number=number) * per
+  print(f"gcj02->wgs  scalar {t:7.1f}ns/pt  batch {timeit.timeit(lambda: geo.gcj02_to_wgs84(glat, glon), number=number) * per:6.1f}ns/pt"
+        f"  (round trip err {err:.3f}m)")
+  converter = geo.DatumConverter(geo.DATUM_GCJ02)
+  path = scalar[:2000]
+  t = timeit.timeit(lambda: converter.path(path), number=1) * 1e6
+  print(f"datum path  2000 points {t:8.1f}us, cached per route {timeit.timeit(lambda: converter.path(path), number=number) / number * 1e6:4.1f}us")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--ticks", type=int, default=2000)
+  parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+  parser.add_argument("--save")
+  parser.add_argument("--check")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50/p99 regression ratio")
+  parser.add_argument("--envelope", action="store_true")
+  parser.add_argument("--turn", action="store_true")
+  parser.add_argument("--geo", action="store_true")
+  args = parser.parse_args()
+  clog.out = io.StringIO()   # keep the carrot log flush thread off the report
+
+  if args.envelope:
+    bench_envelope()
+    return
+  if args.turn:
+    bench_auto_turn()
+    return
+  if args.geo:
+    bench_geo()
+    return
+
+  results = {}
+  for name in args.scenario or SCENARIOS:
+    r = results[name] = run_scenario(name, args.ticks)
+    print(f"{name:16s} p50={r['p50_us']:8.1f}us p99={r['p99_us']:8.1f}us max={r['max_us']:8.1f}us alloc={r['alloc_peak_kb']:7.1f}kB")
+
+  if args.save:
+    with open(args.save, "w") as f:
+      json.dump(results, f, indent=2)
+
+  if args.check:
+    with open(args.check) as f:
+      baseline = json.load(f)
+    failed = False
+    for name, r in results.items():
+      base = baseline.get(name)
+      if base is None:
+        continue
+      for key in ("p50_us", "p99_us"):
+        if r[key] > base[key] * (1 + args.tolerance):
+          print(f"FAIL {name} {key}: {r[key]:.1f}us > baseline {base[key]:.1f}us (+{args.tolerance:.0%})")
+          failed = True
+    print("FAIL" if failed else "PASS")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+  main()
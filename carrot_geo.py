@@ -0,0 +1,306 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371000.0
+M_PER_DEG_LAT = EARTH_RADIUS * math.pi / 180.0
+
+
+# The batched functions below take scalars or arrays and compute in `dtype`. float32 halves memory and
+# is fine for distances/bearings between points a few km apart or more, but absolute lat/lon in float32
+# only resolve ~1m and short haversine distances lose precision: keep positions in float64.
+
+
+def angle_diff(a, b):
+  """a - b in degrees, wrapped to [-180, 180)."""
+  return (a - b + 180.0) % 360.0 - 180.0
+
+
+def wrap360(a):
+  """Angle in degrees wrapped to [0, 360)."""
+  return a % 360.0
+
+
+def bearing_to_heading(bearing):
+  """Compass bearing [deg, clockwise from north] -> math heading [rad, counter-clockwise from east]."""
+  return np.radians(90.0 - bearing)
+
+
+def haversine(lat1, lon1, lat2, lon2, dtype=np.float64):
+  """Great-circle distance [m]."""
+  lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=dtype)) for v in (lat1, lon1, lat2, lon2))
+  a = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+  return (2 * EARTH_RADIUS) * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def initial_bearing(lat1, lon1, lat2, lon2, dtype=np.float64):
+  """Compass bearing [deg, 0..360) at point 1 of the great circle to point 2."""
+  lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=dtype)) for v in (lat1, lon1, lat2, lon2))
+  dlon = lon2 - lon1
+  y = np.sin(dlon) * np.cos(lat2)
+  x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+  return wrap360(np.degrees(np.arctan2(y, x)))
+
+
+def destination_point(lat, lon, dist, bearing, dtype=np.float64):
+  """Great-circle point `dist` [m] from (lat, lon) along `bearing` [deg]; exact where destination() is not."""
+  lat, lon, bearing = (np.radians(np.asarray(v, dtype=dtype)) for v in (lat, lon, bearing))
+  delta = np.asarray(dist, dtype=dtype) / EARTH_RADIUS
+  lat2 = np.arcsin(np.sin(lat) * np.cos(delta) + np.cos(lat) * np.sin(delta) * np.cos(bearing))
+  lon2 = lon + np.arctan2(np.sin(bearing) * np.sin(delta) * np.cos(lat), np.cos(delta) - np.sin(lat) * np.sin(lat2))
+  return np.degrees(lat2), (np.degrees(lon2) + 540.0) % 360.0 - 180.0
+
+
+def project(lat, lon, lat0, lon0, dtype=np.float64):
+  """Batched LocalFrame(lat0, lon0).to_enu(); the offsets are taken in float64 before the cast."""
+  frame = LocalFrame(lat0, lon0)
+  e, n = frame.to_enu(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+  return e.astype(dtype, copy=False), n.astype(dtype, copy=False)
+
+
+class LocalFrame:
+  """East-North tangent plane anchored at (lat0, lon0), equirectangular scale.
+
+  Good to well under a meter for the few hundred meters travelled between fixes. to_geodetic() and
+  to_enu() take scalars or NumPy arrays.
+  """
+  def __init__(self, lat0=0.0, lon0=0.0):
+    self.lat0 = lat0
+    self.lon0 = lon0
+    self.m_per_deg_lon = M_PER_DEG_LAT * math.cos(math.radians(lat0))
+
+  def move(self, lat0, lon0):
+    """Re-anchors the frame; cos(lat) is only recomputed after ~1km north/south."""
+    if abs(lat0 - self.lat0) > 0.01:
+      self.m_per_deg_lon = M_PER_DEG_LAT * math.cos(math.radians(lat0))
+    self.lat0 = lat0
+    self.lon0 = lon0
+
+  def to_geodetic(self, e, n):
+    return self.lat0 + n / M_PER_DEG_LAT, self.lon0 + e / self.m_per_deg_lon
+
+  def to_enu(self, lat, lon):
+    return (lon - self.lon0) * self.m_per_deg_lon, (lat - self.lat0) * M_PER_DEG_LAT
+
+
+class DeadReckoner:
+  """Position between GPS fixes from v_ego and yaw rate, integrated in the ENU frame of the last fix.
+
+  fix() anchors the frame; step() advances by the time since the previous step. The yaw rate
+  [rad/s, counter-clockwise positive] is accumulated on top of the bearing the caller passes, so a
+  curve taken between two fixes bends the estimate instead of extrapolating along a straight line.
+  """
+  def __init__(self):
+    self.frame = LocalFrame()
+    self.t_fix = None
+    self.t = 0.0
+    self.e = self.n = 0.0
+    self.yaw = 0.0   # [deg] heading change since the fix, compass convention
+
+  def fix(self, lat, lon, t):
+    self.frame.move(lat, lon)
+    self.t_fix = self.t = t
+    self.e = self.n = 0.0
+    self.yaw = 0.0
+
+  def step(self, t, speed, bearing, yaw_rate=0.0):
+    """Returns (lat, lon, heading) at time t."""
+    dt = t - self.t
+    self.t = t
+    if dt > 0:
+      self.yaw -= math.degrees(yaw_rate) * dt
+      h = math.radians(bearing + self.yaw)
+      d = speed * dt
+      self.e += d * math.sin(h)
+      self.n += d * math.cos(h)
+    lat, lon = self.frame.to_geodetic(self.e, self.n)
+    return lat, lon, wrap360(bearing + self.yaw)
+
+
+class GpsFusion(DeadReckoner):
+  """Accuracy-weighted fusion of navi, phone and device fixes on top of the dead reckoning.
+
+  The position is a 2D Kalman filter with isotropic covariance, so predict and update are a few
+  scalar operations: step() grows the variance with time and distance travelled, update() weighs a
+  fix by its accuracy [m] and latency [s] and gates it on the normalized innovation. A fix is only
+  forced through after `max_rejects` consecutive rejections (a real jump, e.g. after a tunnel).
+  The bearing bias of the navi heading is a separate scalar state, fed by update_bias().
+  """
+  def __init__(self, q_pos=0.5, sigma_heading=3.0, gate=13.8, max_rejects=5, q_bias=0.01):
+    super().__init__()
+    self.q_pos = q_pos
+    self.sigma_heading = math.radians(sigma_heading)
+    self.gate = gate
+    self.max_rejects = max_rejects
+    self.q_bias = q_bias
+    self.p = 0.0
+    self.rejects = 0
+    self.speed = 0.0
+    self.bearing = 0.0
+    self.bias = 0.0
+    self.p_bias = 25.0
+
+  def step(self, t, speed, bearing, yaw_rate=0.0):
+    dt = t - self.t
+    self.speed, self.bearing = speed, bearing
+    if dt > 0:
+      d = speed * dt
+      self.p += self.q_pos * dt + (d * self.sigma_heading) ** 2
+    return super().step(t, speed, bearing, yaw_rate)
+
+  def update(self, t, lat, lon, accuracy, latency=0.0):
+    """Returns False if the fix was rejected as an outlier."""
+    r = accuracy ** 2 + (self.speed * latency * 0.5) ** 2
+    if self.t_fix is None:
+      self.fix(lat, lon, t)
+      self.p = r
+      return True
+    if t > self.t:
+      self.step(t, self.speed, self.bearing)
+    ze, zn = self.frame.to_enu(lat, lon)
+    if latency > 0:   # the fix is `latency` old: carry it to now along the bearing
+      h = math.radians(self.bearing + self.yaw)
+      ze += self.speed * latency * math.sin(h)
+      zn += self.speed * latency * math.cos(h)
+    ye, yn = ze - self.e, zn - self.n
+    s = self.p + r
+    if (ye * ye + yn * yn) / s > self.gate:
+      self.rejects += 1
+      if self.rejects <= self.max_rejects:
+        return False
+      self.e, self.n, self.p = ze, zn, r
+    else:
+      k = self.p / s
+      self.e += k * ye
+      self.n += k * yn
+      self.p *= 1.0 - k
+    self.rejects = 0
+    self.t_fix = t
+    self.yaw = 0.0   # the sources report a fresh bearing with each fix
+    if abs(self.e) > 1000.0 or abs(self.n) > 1000.0:
+      lat0, lon0 = self.frame.to_geodetic(self.e, self.n)
+      self.frame.move(lat0, lon0)
+      self.e = self.n = 0.0
+    return True
+
+  def update_bias(self, measured, variance):
+    self.p_bias += self.q_bias
+    k = self.p_bias / (self.p_bias + variance)
+    self.bias += k * angle_diff(measured, self.bias)
+    self.p_bias *= 1.0 - k
+    return self.bias
+
+  def reset_bias(self):
+    self.bias = 0.0
+    self.p_bias = 25.0
+    return self.bias
+
+
+def dead_reckon(lat, lon, bearing, dt, speed, yaw_rate=0.0):
+  """Batched propagation from one fix: dt, speed [m/s] and yaw_rate [rad/s] are per-step arrays.
+
+  Returns (lat, lon, heading) arrays, one entry per step, the same as feeding DeadReckoner.step().
+  """
+  dt = np.asarray(dt, dtype=float)
+  heading = bearing - np.cumsum(np.degrees(np.broadcast_to(yaw_rate, dt.shape)) * dt)
+  h = np.radians(heading)
+  d = np.broadcast_to(speed, dt.shape) * dt
+  frame = LocalFrame(lat, lon)
+  lat_out, lon_out = frame.to_geodetic(np.cumsum(d * np.sin(h)), np.cumsum(d * np.cos(h)))
+  return lat_out, lon_out, wrap360(heading)
+
+
+def destination(lat, lon, dist, bearing):
+  """Point `dist` [m] from (lat, lon) along `bearing` [deg], equirectangular: for short distances."""
+  h = np.radians(bearing)
+  return lat + dist * np.cos(h) / M_PER_DEG_LAT, lon + dist * np.sin(h) / (M_PER_DEG_LAT * np.cos(np.radians(lat)))
+
+
+# GCJ-02 is the datum of Chinese map providers (Amap/AutoNavi): WGS-84 plus an offset of a few hundred
+# meters that is only applied inside China. Constants are those of the published Krasovsky-based formula.
+DATUM_WGS84 = "wgs84"
+DATUM_GCJ02 = "gcj02"
+_GCJ_A = 6378245.0
+_GCJ_EE = 0.00669342162296594323
+
+
+def out_of_china(lat, lon):
+  return (lon < 72.004) | (lon > 137.8347) | (lat < 0.8293) | (lat > 55.8271)
+
+
+def _gcj_offset(lat, lon):
+  """GCJ-02 minus WGS-84 [deg] at (lat, lon); math on floats, NumPy on arrays."""
+  xp = math if isinstance(lat, float) and isinstance(lon, float) else np
+  x, y = lon - 105.0, lat - 35.0
+  sqrt_x = xp.sqrt(abs(x))
+  px, py = x * math.pi, y * math.pi
+  ripple = (20.0 * xp.sin(6.0 * px) + 20.0 * xp.sin(2.0 * px)) * 2.0 / 3.0
+  dlat = -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * x * y + 0.2 * sqrt_x + ripple
+  dlat += (20.0 * xp.sin(py) + 40.0 * xp.sin(py / 3.0)) * 2.0 / 3.0
+  dlat += (160.0 * xp.sin(py / 12.0) + 320.0 * xp.sin(py / 30.0)) * 2.0 / 3.0
+  dlon = 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * x * y + 0.1 * sqrt_x + ripple
+  dlon += (20.0 * xp.sin(px) + 40.0 * xp.sin(px / 3.0)) * 2.0 / 3.0
+  dlon += (150.0 * xp.sin(px / 12.0) + 300.0 * xp.sin(px / 30.0)) * 2.0 / 3.0
+  rad_lat = lat * (math.pi / 180.0)
+  magic = 1.0 - _GCJ_EE * xp.sin(rad_lat) ** 2
+  dlat = dlat * 180.0 / ((_GCJ_A * (1.0 - _GCJ_EE)) / (magic * xp.sqrt(magic)) * math.pi)
+  dlon = dlon * 180.0 / (_GCJ_A / xp.sqrt(magic) * xp.cos(rad_lat) * math.pi)
+  return dlat, dlon
+
+
+def wgs84_to_gcj02(lat, lon):
+  """Scalars stay on the math path (~2us); arrays are converted in one NumPy pass."""
+  if isinstance(lat, float) and isinstance(lon, float):
+    if out_of_china(lat, lon):
+      return lat, lon
+    dlat, dlon = _gcj_offset(lat, lon)
+    return lat + dlat, lon + dlon
+  lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+  dlat, dlon = _gcj_offset(lat, lon)
+  outside = out_of_china(lat, lon)
+  return np.where(outside, lat, lat + dlat), np.where(outside, lon, lon + dlon)
+
+
+def gcj02_to_wgs84(lat, lon, iterations=2):
+  """Inverse of wgs84_to_gcj02() by fixed-point iteration; the offset varies slowly enough that two
+  iterations are within a few centimeters."""
+  if not (isinstance(lat, float) and isinstance(lon, float)):
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+  w_lat, w_lon = lat, lon
+  for _ in range(iterations):
+    g_lat, g_lon = wgs84_to_gcj02(w_lat, w_lon)
+    w_lat, w_lon = w_lat - (g_lat - lat), w_lon - (g_lon - lon)
+  return w_lat, w_lon
+
+
+class DatumConverter:
+  """Brings positions reported in `datum` into WGS-84, the datum of the device GPS.
+
+  point() is the per-fix conversion; path() converts a whole (lat, lon) polyline in one NumPy pass
+  and keeps the result until a different path is passed, so a route is converted once.
+  """
+  def __init__(self, datum=DATUM_WGS84):
+    if datum not in (DATUM_WGS84, DATUM_GCJ02):
+      raise ValueError(f"unknown datum: {datum!r}")
+    self.datum = datum
+    self._path_src = None
+    self._path_key = None
+    self._path = np.zeros((0, 2))
+
+  def point(self, lat, lon):
+    if self.datum == DATUM_WGS84 or lat == 0.0:
+      return lat, lon
+    return gcj02_to_wgs84(float(lat), float(lon))
+
+  def path(self, coords):
+    """(lat, lon) sequence -> (n, 2) float64 array in WGS-84."""
+    if coords is self._path_src:
+      return self._path
+    if self._path_key is None or list(coords) != self._path_key:
+      latlon = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+      if self.datum == DATUM_GCJ02 and len(latlon):
+        latlon = np.column_stack(gcj02_to_wgs84(latlon[:, 0], latlon[:, 1]))
+      self._path_key = list(coords)
+      self._path = latlon
+    self._path_src = coords
+    return self._path
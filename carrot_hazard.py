@@ -0,0 +1,98 @@
+import bisect
+import threading
+
+HAZARD_CAMERA = 0
+HAZARD_BUMP = 1
+HAZARD_SECTION = 2   # section enforcement zone, pos = end of the zone
+
+
+class Hazard:
+  __slots__ = ("pos", "kind", "type", "speed", "seen")
+
+  def __init__(self, pos, kind, type, speed, seen):
+    self.pos = pos
+    self.kind = kind
+    self.type = type
+    self.speed = speed
+    self.seen = seen
+
+  def __lt__(self, other):
+    return self.pos < other.pos
+
+
+class HazardQueue:
+  """Upcoming cameras, bumps and section zones ordered by along-route position.
+
+  Positions are absolute on one integrated odometer, so advancing the vehicle is a single add
+  (no per-entry subtraction) and the remaining distance of an entry is `pos - odo`.
+  Packets upsert what the phone reports; an entry not reported for `stale_packets` packets is dropped.
+  Cameras and bumps are scanned from the front up to a horizon, section zones (the vehicle is
+  inside them until their end) are kept apart. Packets may come from the receiver thread while the
+  tick advances, so every method takes the lock.
+  """
+  def __init__(self, stale_packets=3):
+    self.odo = 0.0
+    self.entries = []   # cameras and bumps
+    self.zones = []     # section zones
+    self.generation = 0
+    self.stale_packets = stale_packets
+    self.lock = threading.Lock()
+
+  def _list(self, kind):
+    return self.zones if kind == HAZARD_SECTION else self.entries
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.zones.clear()
+
+  def advance(self, delta_dist):
+    with self.lock:
+      self.odo += delta_dist
+      for entries in (self.entries, self.zones):
+        i = bisect.bisect_left(entries, self.odo, key=_pos)
+        if i:
+          del entries[:i]
+
+  def upsert(self, kind, type, dist, speed):
+    with self.lock:
+      entries = self._list(kind)
+      pos = self.odo + dist
+      tolerance = max(20., dist * 0.05)
+      for i, h in enumerate(entries):
+        if h.kind == kind and h.type == type and abs(h.pos - pos) < tolerance:
+          del entries[i]
+          h.pos, h.speed, h.seen = pos, speed, self.generation
+          bisect.insort(entries, h)
+          return h
+      h = Hazard(pos, kind, type, speed, self.generation)
+      bisect.insort(entries, h)
+      return h
+
+  def commit(self):
+    """Called after all hazards of a packet were upserted."""
+    with self.lock:
+      oldest = self.generation - self.stale_packets
+      self.entries = [h for h in self.entries if h.seen > oldest]
+      self.zones = [h for h in self.zones if h.seen > oldest]
+      self.generation += 1
+
+  def upcoming(self, horizon):
+    """(remaining distance, hazard) of the cameras and bumps up to `horizon` [m] ahead."""
+    with self.lock:
+      odo = self.odo
+      out = []
+      for h in self.entries:
+        dist = h.pos - odo
+        if dist > horizon:
+          break
+        out.append((dist, h))
+      return out
+
+  def active_zones(self):
+    with self.lock:
+      return list(self.zones)
+
+
+def _pos(h):
+  return h.pos
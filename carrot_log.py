@@ -0,0 +1,80 @@
+import collections
+import sys
+import threading
+import time
+
+
+class CarrotLog:
+  """In-memory ring buffer logger for the carrot hot paths.
+
+  log() only stores (time, key, fmt, args); formatting and stdout writes happen on a background
+  flush thread. Every entry stays in the ring buffer for dump(), but only entries that pass the
+  per-key rate limit are flushed to stdout.
+  """
+  def __init__(self, capacity=3000, flush_interval=1.0, out=None):
+    self.ring = collections.deque(maxlen=capacity)
+    self.pending = collections.deque(maxlen=capacity)
+    self.intervals = {}
+    self.last = {}
+    self.suppressed = collections.Counter()
+    self.flush_interval = flush_interval
+    self.out = out
+    self._thread = None
+
+  def set_rate(self, key, interval):
+    self.intervals[key] = interval
+
+  def log(self, key, fmt, *args):
+    t = time.time()
+    entry = (t, key, fmt, args)
+    self.ring.append(entry)
+
+    interval = self.intervals.get(key, 0.0)
+    if interval > 0.0:
+      if t - self.last.get(key, 0.0) < interval:
+        self.suppressed[key] += 1
+        return
+      self.last[key] = t
+    self.pending.append(entry)
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="carrot_log", daemon=True)
+      self._thread.start()
+
+  @staticmethod
+  def format(entry):
+    t, key, fmt, args = entry
+    try:
+      text = fmt.format(*args)
+    except (IndexError, KeyError, ValueError):
+      text = f"{fmt} {args}"
+    return f"{time.strftime('%H:%M:%S', time.localtime(t))}.{int(t * 1000) % 1000:03d} [{key}] {text}"
+
+  def dump(self, seconds=None):
+    """Formatted entries of the last `seconds` (all buffered entries if None)."""
+    entries = list(self.ring)
+    if seconds is not None:
+      t_min = time.time() - seconds
+      entries = [e for e in entries if e[0] >= t_min]
+    return [self.format(e) for e in entries]
+
+  def flush(self):
+    out = self.out or sys.stdout
+    lines = []
+    while self.pending:
+      lines.append(self.format(self.pending.popleft()))
+    if lines:
+      out.write("\n".join(lines) + "\n")
+      out.flush()
+
+  def _run(self):
+    while True:
+      time.sleep(self.flush_interval)
+      try:
+        self.flush()
+      except Exception:
+        pass
+
+
+clog = CarrotLog()
+clog.set_rate("navi", 1.0)
+clog.set_rate("phone_gps", 1.0)
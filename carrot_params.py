@@ -0,0 +1,44 @@
+import os
+import threading
+import time
+
+
+class ParamsWatcher:
+  """Polls params directories in the background and bumps `version` on change.
+
+  openpilot's Params.put() writes through a temp file + rename, so the mtime of
+  the params directory moves on every write. Readers only compare `version`
+  against the version they last loaded; no file I/O happens on their side.
+  """
+  def __init__(self, paths, interval=1.0):
+    self.paths = [p for p in paths if p]
+    self.interval = interval
+    self.version = 0
+    self._mtimes = self._stat()
+    self._stop = threading.Event()
+
+    self._thread = threading.Thread(target=self._run, name="carrot_params_watcher", daemon=True)
+    self._thread.start()
+
+  def bump(self):
+    self.version += 1
+
+  def stop(self):
+    self._stop.set()
+    self._thread.join()
+
+  def _stat(self):
+    mtimes = []
+    for path in self.paths:
+      try:
+        mtimes.append(os.stat(path).st_mtime_ns)
+      except OSError:
+        mtimes.append(0)
+    return tuple(mtimes)
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      mtimes = self._stat()
+      if mtimes != self._mtimes:
+        self._mtimes = mtimes
+        self.version += 1
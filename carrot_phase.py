@@ -0,0 +1,229 @@
+import collections
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from openpilot.system.hardware import PC
+from openpilot.system.hardware.hw import Paths
+from openpilot.selfdrive.carrot.carrot_geo import wrap360
+from openpilot.selfdrive.carrot.carrot_traffic import TRAFFIC_NONE, TRAFFIC_RED, TRAFFIC_GREEN
+
+if PC:
+  PHASE_DB_PATH = os.path.join(Paths.comma_home(), "media", "carrot", "traffic_phase.db")
+else:
+  PHASE_DB_PATH = "/data/media/carrot/traffic_phase.db"
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lon, precision=7):
+  """Standard geohash; precision 7 is a ~150m x 150m cell."""
+  lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+  out = []
+  bits = ch = 0
+  even = True
+  while len(out) < precision:
+    if even:
+      mid = (lon_lo + lon_hi) / 2
+      if lon >= mid:
+        ch = ch * 2 + 1
+        lon_lo = mid
+      else:
+        ch *= 2
+        lon_hi = mid
+    else:
+      mid = (lat_lo + lat_hi) / 2
+      if lat >= mid:
+        ch = ch * 2 + 1
+        lat_lo = mid
+      else:
+        ch *= 2
+        lat_hi = mid
+    even = not even
+    bits += 1
+    if bits == 5:
+      out.append(_BASE32[ch])
+      bits = ch = 0
+  return "".join(out)
+
+
+def phase_key(lat, lon, bearing, precision=7):
+  """Location key of a light: geohash cell + one of 8 approach directions."""
+  return f"{geohash(lat, lon, precision)}:{int((wrap360(bearing) + 22.5) // 45) % 8}"
+
+
+class PhaseStats:
+  __slots__ = ("red_n", "red_mean", "wait_n", "wait_mean")
+
+  def __init__(self, red_n=0, red_mean=0.0, wait_n=0, wait_mean=0.0):
+    self.red_n = red_n
+    self.red_mean = red_mean
+    self.wait_n = wait_n
+    self.wait_mean = wait_mean
+
+
+class PhaseStore:
+  """SQLite store of red phase statistics per location key, bounded to `max_entries` rows (LRU).
+
+  All SQLite work happens on a background thread; the tick only posts requests and drains results,
+  so nothing on the tick path waits for the disk.
+  """
+  def __init__(self, path=PHASE_DB_PATH, max_entries=5000):
+    self.path = path
+    self.max_entries = max_entries
+    self.requests = queue.SimpleQueue()
+    self.results = collections.deque()
+    self._thread = None
+
+  def fetch(self, key):
+    """Posts a lookup; the stats arrive in `results`. A read counts as a use for the LRU trim."""
+    self._post(("get", key))
+
+  def touch(self, key):
+    self._post(("touch", key))
+
+  def save(self, key, stats):
+    self._post(("put", key, stats.red_n, stats.red_mean, stats.wait_n, stats.wait_mean))
+
+  def _post(self, request):
+    self.requests.put(request)
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="carrot_phase", daemon=True)
+      self._thread.start()
+
+  def _connect(self):
+    if self.path != ":memory:":
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    conn = sqlite3.connect(self.path)
+    conn.execute("""
+      CREATE TABLE IF NOT EXISTS phases (
+        key TEXT PRIMARY KEY,
+        red_n INTEGER, red_mean REAL,
+        wait_n INTEGER, wait_mean REAL,
+        last_used REAL
+      )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS phases_last_used ON phases (last_used)")
+    conn.commit()
+    return conn
+
+  def _run(self):
+    try:
+      conn = self._connect()
+    except (OSError, sqlite3.Error) as e:
+      print(f"carrot_phase: store disabled, {e}")
+      return
+    writes = 0
+    while True:
+      request = self.requests.get()
+      now = time.time()   # wall clock: last_used has to order uses across reboots
+      try:
+        if request[0] == "get":
+          row = conn.execute("SELECT red_n, red_mean, wait_n, wait_mean FROM phases WHERE key = ?", (request[1],)).fetchone()
+          self.results.append((request[1], PhaseStats(*row) if row else PhaseStats()))
+          if row:
+            conn.execute("UPDATE phases SET last_used = ? WHERE key = ?", (now, request[1]))
+            conn.commit()
+        elif request[0] == "touch":
+          conn.execute("UPDATE phases SET last_used = ? WHERE key = ?", (now, request[1]))
+          conn.commit()
+        else:
+          conn.execute("INSERT OR REPLACE INTO phases VALUES (?, ?, ?, ?, ?, ?)", (*request[1:], now))
+          writes += 1
+          if writes % 64 == 0:
+            conn.execute("DELETE FROM phases WHERE key IN (SELECT key FROM phases ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                         (self.max_entries,))
+          conn.commit()
+      except sqlite3.Error as e:
+        print(f"carrot_phase: {e}")
+
+
+class TrafficPhasePredictor:
+  """Learns how long lights stay red at each location and predicts the time to green.
+
+  A red phase is keyed where the red was first seen (phase_key of position and bearing). When the
+  red onset was observed (green -> red) the full red duration is learned, otherwise only the wait
+  from arrival. Without a position fix nothing is keyed, learned or looked up. update() is O(1): a
+  dict lookup into the in-memory LRU, refilled by the store; predict() is only evaluated on demand.
+  """
+  def __init__(self, store=None, cache_size=256, onset_window=3.0, lost_timeout=10.0):
+    self.store = store if store is not None else PhaseStore()
+    self.cache = collections.OrderedDict()
+    self.cache_size = cache_size
+    self.onset_window = onset_window
+    self.lost_timeout = lost_timeout
+    self.key = None
+    self.red_since = None
+    self.red_onset = False
+    self.last_green = None
+    self.last_seen = None
+
+  def _drain(self):
+    results = self.store.results
+    while results:
+      key, stats = results.popleft()
+      self.cache.setdefault(key, stats)
+      self._trim()
+
+  def _trim(self):
+    while len(self.cache) > self.cache_size:
+      self.cache.popitem(last=False)
+
+  def _learn(self, duration):
+    stats = self.cache.get(self.key)
+    if stats is None:
+      stats = self.cache[self.key] = PhaseStats()
+      self._trim()
+    if self.red_onset:
+      stats.red_n += 1
+      stats.red_mean += (duration - stats.red_mean) / min(stats.red_n, 20)
+    else:
+      stats.wait_n += 1
+      stats.wait_mean += (duration - stats.wait_mean) / min(stats.wait_n, 20)
+    self.store.save(self.key, stats)
+
+  def update(self, now, lat, lon, bearing, traffic_state):
+    if self.store.results:
+      self._drain()
+
+    if traffic_state != TRAFFIC_NONE:
+      self.last_seen = now
+    has_fix = lat != 0.0 or lon != 0.0
+    if traffic_state == TRAFFIC_RED and self.red_since is None:
+      if not has_fix:   # a key without a position would merge every light into one cell
+        return
+      self.red_since = now
+      self.red_onset = self.last_green is not None and now - self.last_green < self.onset_window
+      self.key = phase_key(lat, lon, bearing)
+      if self.key in self.cache:
+        self.cache.move_to_end(self.key)
+        self.store.touch(self.key)
+      else:
+        self.store.fetch(self.key)
+    elif traffic_state == TRAFFIC_GREEN:
+      if self.red_since is not None:
+        duration = now - self.red_since
+        if 3.0 <= duration <= 300.0:
+          self._learn(duration)
+        self.red_since = None
+      self.last_green = now
+    elif self.red_since is not None and now - self.last_seen > self.lost_timeout:
+      self.red_since = None
+
+  def predict(self, now):
+    """Seconds until the current red turns green, -1 if unknown."""
+    if self.red_since is None:
+      return -1.0
+    stats = self.cache.get(self.key)
+    if stats is None:
+      return -1.0
+    elapsed = now - self.red_since
+    if self.red_onset and stats.red_n > 0:
+      return max(stats.red_mean - elapsed, 0.0)
+    if stats.wait_n > 0:
+      return max(stats.wait_mean - elapsed, 0.0)
+    if stats.red_n > 0:
+      return max(stats.red_mean / 2 - elapsed, 0.0)
+    return -1.0
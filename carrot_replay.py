@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+CarrotServ record / replay.
+
+Recording: set CARROT_RECORD=/path/to/file.jsonl.gz before starting carrot_man.
+  Every packet passed to CarrotServ.update() and every update_navi() tick (the SubMaster
+  fields it reads + its arguments) is appended with its monotonic timestamp.
+
+Replay:  python carrot_replay.py /path/to/file.jsonl.gz
+  Feeds the records back into a fresh CarrotServ with an injected clock, as fast as possible,
+  and collects the carrotMan output of every tick.
+
+A recorder is closed at exit (and on SIGTERM by carrot_serv.main()); a file cut short by a kill
+still loads up to its last flush.
+"""
+import atexit
+import gzip
+import json
+import sys
+import threading
+import time
+
+import cereal.messaging as messaging
+
+# SubMaster fields read by CarrotServ.update_navi(); the gps service is stored under "gps".
+SM_FIELDS = {
+  "carState": ("vEgo", "speedLimit", "speedLimitDistance", "gasPressed", "brakePressed", "steeringPressed", "steeringTorque",
+               "yawRate"),
+  "carControl": (),
+  "selfdriveState": ("distanceTraveled",),
+  "navInstruction": ("distanceRemaining", "timeRemaining", "speedLimit", "maneuverDistance",
+                     "maneuverPrimaryText", "maneuverType", "maneuverModifier"),
+  "gps": ("hasFix", "latitude", "longitude", "bearingDeg", "horizontalAccuracy"),
+}
+
+_recorders = set()
+
+OUTPUT_FIELDS = ("activeCarrot", "nRoadLimitSpeed", "xSpdType", "xSpdLimit", "xSpdDist", "xSpdCountDown",
+                 "xTurnInfo", "xDistToTurn", "xTurnCountDown", "atcType", "desiredSpeed", "desiredSource",
+                 "trafficState", "xPosAngle", "xPosLat", "xPosLon", "leftSec")
+
+
+class CarrotRecorder:
+  def __init__(self, path):
+    self.f = gzip.open(path, "wt", encoding="utf8")
+    self.lock = threading.Lock()
+    self.params_version = None
+    self.coords = None
+    self.count = 0
+    _recorders.add(self)
+    atexit.register(self.close)
+
+  def _write(self, record):
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    with self.lock:
+      self.f.write(line + "\n")
+      self.count += 1
+      if self.count % 100 == 0:
+        self.f.flush()
+
+  def record_packet(self, t, packet):
+    self._write({"t": t, "k": "p", "d": packet})
+
+  def record_tick(self, t, serv, sm, remote_ip, vturn_speed, coords, distances, route_speed, gps_service):
+    if serv.params_version != self.params_version:
+      self.params_version = serv.params_version
+      self._write({"t": t, "k": "c", "d": serv.params_snapshot._asdict()})
+
+    services = {}
+    for name, fields in SM_FIELDS.items():
+      service = gps_service if name == "gps" else name
+      msg = sm[service]
+      services[name] = [sm.alive[service], sm.valid[service], sm.updated[service], [_plain(getattr(msg, f)) for f in fields]]
+
+    record = {"t": t, "k": "t", "sm": services, "a": [remote_ip, vturn_speed, route_speed]}
+    if coords is not self.coords:
+      self.coords = coords
+      record["route"] = [[list(c) for c in coords], list(distances)]
+    self._write(record)
+
+  def close(self):
+    with self.lock:
+      self.f.close()
+    _recorders.discard(self)
+
+
+def close_recorders():
+  for recorder in list(_recorders):
+    recorder.close()
+
+
+def _plain(v):
+  return v if isinstance(v, (bool, int, float, str)) else str(v)
+
+
+class ReplayClock:
+  def __init__(self):
+    self.t = 0.0
+
+  def __call__(self):
+    return self.t
+
+
+class ReplaySubMaster:
+  def __init__(self, gps_service):
+    self.gps_service = gps_service
+    self.data, self.alive, self.valid, self.updated = {}, {}, {}, {}
+
+  def load(self, services):
+    for name, (alive, valid, updated, values) in services.items():
+      service = self.gps_service if name == "gps" else name
+      msg = getattr(messaging.new_message(service), service)
+      # fields appended to SM_FIELDS later keep their defaults when replaying older recordings
+      for field, value in zip(SM_FIELDS[name], values, strict=False):
+        setattr(msg, field, value)
+      self.data[service] = msg
+      self.alive[service], self.valid[service], self.updated[service] = alive, valid, updated
+
+  def __getitem__(self, service):
+    return self.data[service]
+
+
+class ReplayPubMaster:
+  def __init__(self):
+    self.last = {}
+
+  def send(self, service, msg):
+    self.last[service] = msg
+
+
+class _StaticParamsWatcher:
+  def __init__(self):
+    self.version = 0
+
+  def stop(self):
+    pass
+
+
+def load(path):
+  """Records of a recording; one that was never closed yields the records up to its last flush."""
+  records = []
+  with gzip.open(path, "rt", encoding="utf8") as f:
+    try:
+      for line in f:
+        if not line.endswith("\n"):
+          break
+        if line.strip():
+          records.append(json.loads(line))
+    except EOFError:
+      pass
+  return records
+
+
+def replay(records, serv=None, gps_service="gpsLocationExternal"):
+  """Feed records into CarrotServ deterministically; returns the carrotMan outputs, one dict per tick."""
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ, CarrotServParams
+  from openpilot.selfdrive.carrot.carrot_phase import PhaseStore, TrafficPhasePredictor
+  clock = ReplayClock()
+  owned = serv is None
+  if owned:
+    serv = CarrotServ()
+  serv.clock = clock
+  serv.traffic_phase = TrafficPhasePredictor(PhaseStore(":memory:"))   # keep the on-device phase store out of replays
+  serv.params_watcher.stop()
+  serv.params_watcher = _StaticParamsWatcher()
+  serv.params_version = serv.params_watcher.version
+
+  sm, pm = ReplaySubMaster(gps_service), ReplayPubMaster()
+  coords, distances = [], []
+  outputs = []
+  for r in records:
+    clock.t = r["t"]
+    kind = r["k"]
+    if kind == "p":
+      serv.update(r["d"])
+    elif kind == "c":
+      # a new params version, so that caches keyed on it (the turn plan) are rebuilt
+      serv.params_watcher.version += 1
+      serv.params_version = serv.params_watcher.version
+      serv.apply_params(CarrotServParams(**r["d"]))
+    elif kind == "t":
+      sm.load(r["sm"])
+      if "route" in r:
+        coords, distances = [tuple(c) for c in r["route"][0]], r["route"][1]
+      remote_ip, vturn_speed, route_speed = r["a"]
+      serv.update_navi(remote_ip, sm, pm, vturn_speed, coords, distances, route_speed, gps_service)
+      cm = pm.last["carrotMan"].carrotMan
+      outputs.append({f: getattr(cm, f) for f in OUTPUT_FIELDS})
+  if owned:
+    serv.close()
+  return outputs
+
+
+def main():
+  records = load(sys.argv[1])
+  t0 = time.perf_counter()
+  outputs = replay(records)
+  dt = time.perf_counter() - t0
+  span = records[-1]["t"] - records[0]["t"] if records else 0.0
+  print(f"replayed {len(records)} records, {len(outputs)} ticks ({span:.1f}s of driving) in {dt:.2f}s")
+  for o in outputs[-5:]:
+    print(o)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,216 @@
+import math
+import threading
+
+import numpy as np
+
+from openpilot.selfdrive.carrot.carrot_speed import V_MAX_KPH
+
+ROUTE_LAT_ACCEL = 2.0       # [m/s^2] allowed lateral accel in curves
+ROUTE_CURVE_SPAN = 15.0     # [m] curvature is taken over the points this far behind/ahead
+
+
+def path_curvature(xy, s, span=ROUTE_CURVE_SPAN):
+  """Unsigned curvature [1/m] at every point of the polyline xy (n x 2) with cumulative distances s.
+
+  Menger curvature of the triangle (point - span, point, point + span) so that dense or noisy points
+  do not blow up the result; points further apart than span use their adjacent points. The end
+  points, which lack a neighbour, get 0.
+  """
+  n = len(s)
+  i = np.arange(n)
+  i0 = np.maximum(np.minimum(np.searchsorted(s, s - span), i - 1), 0)
+  i2 = np.minimum(np.maximum(np.searchsorted(s, s + span, side="right") - 1, i + 1), n - 1)
+  p0, p1, p2 = xy[i0], xy, xy[i2]
+  a = np.hypot(*(p1 - p0).T)
+  b = np.hypot(*(p2 - p1).T)
+  c = np.hypot(*(p2 - p0).T)
+  cross = (p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p1[:, 1] - p0[:, 1]) * (p2[:, 0] - p0[:, 0])
+  denom = a * b * c
+  valid = (i0 < i) & (i2 > i) & (denom > 1e-6)
+  return np.where(valid, 2 * np.abs(cross) / np.where(valid, denom, 1.), 0.)
+
+
+class RouteSpeed:
+  """Curve speed profile [kph] of one naviPaths polyline.
+
+  The lateral-accel-limited speed of every point is reduced so that it can be reached with
+  `decel` [m/s^2] from the points behind it, then stored in a sparse table so that
+  min_speed(start, length) is a binary search plus two lookups.
+  """
+  def __init__(self, coords, distances, decel, lat_accel=ROUTE_LAT_ACCEL, span=ROUTE_CURVE_SPAN):
+    xy = np.asarray(coords, dtype=float).reshape(-1, 2)
+    s = np.asarray(distances, dtype=float)
+    self.s = s
+    self.decel = decel
+    if len(s) < 3:
+      self.speeds = np.full(len(s), V_MAX_KPH)
+      self.levels = [self.speeds]
+      return
+    curvature = path_curvature(xy, s, span)
+    v = np.sqrt(lat_accel / np.maximum(curvature, 1e-9))
+    v = np.minimum(v, V_MAX_KPH / 3.6)
+    # v_i^2 <= v_j^2 + 2a(s_j - s_i) for every j ahead: reverse running min of v_j^2 + 2a*s_j
+    if decel > 0:
+      reach = np.minimum.accumulate((v ** 2 + 2 * decel * s)[::-1])[::-1]
+      v = np.sqrt(np.minimum(v ** 2, np.maximum(reach - 2 * decel * s, 0.)))
+    self.speeds = v * 3.6
+
+    # sparse table: levels[k][i] = min(speeds[i:i + 2**k])
+    self.levels = [self.speeds]
+    k = 1
+    while (1 << k) <= len(s):
+      prev = self.levels[-1]
+      half = 1 << (k - 1)
+      self.levels.append(np.minimum(prev[:-half], prev[half:]))
+      k += 1
+
+  def min_speed(self, start, length):
+    """Lowest speed [kph] of the profile from `start` to `start + length` [m] along the route."""
+    n = len(self.s)
+    if n == 0:
+      return V_MAX_KPH
+    # the point at or behind start bounds the speed at start itself
+    i0 = max(int(np.searchsorted(self.s, start, side="right")) - 1, 0)
+    i1 = max(int(np.searchsorted(self.s, start + length, side="right")) - 1, i0)
+    k = (i1 - i0 + 1).bit_length() - 1
+    level = self.levels[k]
+    return float(min(level[i0], level[i1 - (1 << k) + 1]))
+
+
+class MapMatcher:
+  """Snaps positions onto one route polyline and returns the along-route distance.
+
+  Segments are bucketed once per route into a uniform grid of `cell` [m]: every segment goes into
+  the cells of its corridor, those within `max_dist` of it, so a query is one dict lookup plus a
+  projection onto the few segments of that cell and the cost is flat in the route length. Among the
+  segments within `max_dist` the one closest to the point, with a penalty for jumping away from the
+  predicted along-route distance, wins; without a candidate the prediction is returned unmatched.
+  """
+  def __init__(self, coords, distances, cell=30.0, max_dist=30.0):
+    xy = np.asarray(coords, dtype=float).reshape(-1, 2)
+    s = np.asarray(distances, dtype=float)
+    self.cell = cell
+    self.max_dist = max_dist
+    self.a = xy[:-1]
+    self.d = xy[1:] - xy[:-1]
+    self.len2 = np.maximum((self.d ** 2).sum(axis=1), 1e-9)
+    self.s0 = s[:-1]
+    self.ds = s[1:] - s[:-1]
+    self.length = float(s[-1]) if len(s) else 0.0
+    self.grid = {}
+    if len(self.a):
+      gx, gy, seg = self._corridor_cells()
+      starts = np.flatnonzero(np.r_[True, (gx[1:] != gx[:-1]) | (gy[1:] != gy[:-1])])
+      # per cell: contiguous copies of its segments (ax, ay, dx, dy, len2, s0, ds), no fancy indexing per query
+      table = np.stack([self.a[:, 0], self.a[:, 1], self.d[:, 0], self.d[:, 1], self.len2, self.s0, self.ds])
+      for start, end in zip(starts.tolist(), np.r_[starts[1:], len(seg)].tolist(), strict=True):
+        self.grid[(int(gx[start]), int(gy[start]))] = table[:, seg[start:end]]
+
+  def _corridor_cells(self):
+    """(gx, gy, segment) of every cell within max_dist of a segment, each pair once, sorted by cell.
+
+    Segments are sampled at most one cell apart and the cells around every sample are kept if their
+    center is within max_dist + half a cell diagonal of the segment, so the work grows with segment
+    length rather than with its bounding box.
+    """
+    cell = self.cell
+    n = np.ceil(np.sqrt(self.len2) / cell).astype(int) + 1
+    seg = np.repeat(np.arange(len(n)), n)
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(n) - n, n)) / np.maximum(n - 1, 1)[seg]
+    samples = np.floor((self.a[seg] + t[:, None] * self.d[seg]) / cell).astype(int)
+    k = int(math.ceil(self.max_dist / cell)) + 1
+    ox, oy = (o.ravel() for o in np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1), indexing="ij"))
+    gx, gy = (samples[:, :1] + ox).ravel(), (samples[:, 1:] + oy).ravel()
+    seg = np.repeat(seg, len(ox))
+    # distance of the cell centers to their segment
+    px, py = (gx + 0.5) * cell - self.a[seg, 0], (gy + 0.5) * cell - self.a[seg, 1]
+    dx, dy = self.d[seg, 0], self.d[seg, 1]
+    u = np.clip((px * dx + py * dy) / self.len2[seg], 0.0, 1.0)
+    near = np.hypot(px - u * dx, py - u * dy) <= self.max_dist + cell * math.sqrt(0.5)
+    gx, gy, seg = gx[near], gy[near], seg[near]
+    # one int64 key per (cell, segment): unique() sorts and dedups in a single 1-D pass
+    x0, y0 = gx.min(), gy.min()
+    h, m = int(gy.max() - y0) + 1, len(self.a)
+    key = np.unique(((gx - x0) * h + (gy - y0)) * m + seg)
+    cell_key, seg = np.divmod(key, m)
+    gx, gy = np.divmod(cell_key, h)
+    return gx + x0, gy + y0, seg
+
+  def heading(self, s_from=0.0, length=10.0):
+    """Direction [rad, counter-clockwise from +x] of the route between s_from and s_from + length."""
+    if not len(self.a):
+      return 0.0
+    i = int(np.clip(np.searchsorted(self.s0, s_from, side="right") - 1, 0, len(self.a) - 1))
+    j = int(np.clip(np.searchsorted(self.s0, s_from + length, side="right") - 1, i, len(self.a) - 1))
+    dx, dy = self.a[j] + self.d[j] - self.a[i]
+    return math.atan2(dy, dx)
+
+  def point(self, s):
+    """Route x/y at the along-route distance s."""
+    if not len(self.a):
+      return 0.0, 0.0
+    i = int(np.clip(np.searchsorted(self.s0, s, side="right") - 1, 0, len(self.a) - 1))
+    t = min(max((s - self.s0[i]) / max(self.ds[i], 1e-9), 0.0), 1.0)
+    return float(self.a[i, 0] + t * self.d[i, 0]), float(self.a[i, 1] + t * self.d[i, 1])
+
+  def match(self, x, y, s_pred):
+    """Returns (along-route distance, distance to the route); the latter is -1 when not matched."""
+    segs = self.grid.get((int(math.floor(x / self.cell)), int(math.floor(y / self.cell))))
+    if segs is None:
+      return s_pred, -1.0
+    ax, ay, dx, dy, len2, s0, ds = segs
+    t = np.clip(((x - ax) * dx + (y - ay) * dy) / len2, 0.0, 1.0)
+    dist = np.hypot(ax + t * dx - x, ay + t * dy - y)
+    s = s0 + t * ds
+    cost = np.where(dist <= self.max_dist, dist + 0.1 * np.abs(s - s_pred), np.inf)
+    k = int(np.argmin(cost))
+    if not np.isfinite(cost[k]):
+      return s_pred, -1.0
+    return float(s[k]), float(dist[k])
+
+
+class MatcherBuilder:
+  """Builds MapMatchers on a background thread so that a long route never stalls the tick.
+
+  submit() replaces any route still waiting; the tick picks the finished matcher up from `result`,
+  a (revision, matcher) tuple swapped in by a single assignment.
+  """
+  def __init__(self):
+    self.result = None
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._pending = None
+    self._running = True
+    self._thread = None
+
+  def submit(self, revision, coords, distances):
+    with self._lock:
+      self._pending = (revision, coords, distances)
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="carrot_route", daemon=True)
+      self._thread.start()
+    self._wake.set()
+
+  def take(self, revision):
+    """The matcher of `revision` once it is built, else None."""
+    result = self.result
+    return result[1] if result is not None and result[0] == revision else None
+
+  def stop(self):
+    self._running = False
+    self._wake.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def _run(self):
+    while True:
+      self._wake.wait()
+      self._wake.clear()
+      if not self._running:
+        return
+      with self._lock:
+        job, self._pending = self._pending, None
+      if job is not None:
+        revision, coords, distances = job
+        self.result = (revision, MapMatcher(coords, distances))
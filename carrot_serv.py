@@ -1,7 +1,9 @@
+import collections
 import fcntl
 import json
 import math
 import os
+import signal
 import socket
 import struct
 import subprocess
@@ -20,69 +22,92 @@ from openpilot.system.hardware import PC, TICI
 from openpilot.selfdrive.navd.helpers import Coordinate
 from opendbc.car.common.conversions import Conversions as CV
 from openpilot.common.gps import get_gps_location_service
+from openpilot.selfdrive.carrot.carrot_params import ParamsWatcher
+from openpilot.selfdrive.carrot import carrot_wire
+from openpilot.selfdrive.carrot.carrot_log import clog
+from openpilot.selfdrive.carrot.carrot_speed import V_MAX_KPH, SpeedArbiter, SpeedProfile, speed_trace, SPEED_TRACE_PATH
+from openpilot.selfdrive.carrot.carrot_route import MatcherBuilder, RouteSpeed
+from openpilot.selfdrive.carrot.carrot_geo import DATUM_WGS84, DatumConverter, GpsFusion, LocalFrame, angle_diff, bearing_to_heading, \
+                                                    destination, wrap360
+from openpilot.selfdrive.carrot.carrot_traffic import TrafficLightTracker, TRAFFIC_NONE, parse_detect
+from openpilot.selfdrive.carrot.carrot_phase import TrafficPhasePredictor
+from openpilot.selfdrive.carrot.carrot_hazard import HazardQueue, HAZARD_CAMERA, HAZARD_BUMP, HAZARD_SECTION
+from openpilot.selfdrive.carrot.carrot_tables import nav_type_mapping, nav_type_reverse, turn_type_mapping, sdi_descr_table
+
+# CarrotServ tunables, loaded from Params as one immutable snapshot.
+CarrotServParams = collections.namedtuple("CarrotServParams", [
+  "autoNaviSpeedBumpSpeed", "autoNaviSpeedBumpTime", "autoNaviSpeedCtrlEnd", "autoNaviSpeedCtrlMode",
+  "autoNaviSpeedSafetyFactor", "autoNaviSpeedDecelRate", "autoNaviCountDownMode", "turnSpeedControlMode",
+  "mapTurnSpeedFactor", "autoTurnControlSpeedTurn", "autoTurnMapChange", "autoTurnControl",
+  "autoTurnControlTurnEnd", "autoCurveSpeedLowerLimit", "is_metric", "autoRoadSpeedLimitOffset", "lang",
+])
+
+_TURN_PLAN_NONE = ("none", 0, 0, 1000)
+
+# GpsFusion: navi fixes are map matched and report no accuracy; phone/device accuracy is floored.
+GPS_ACCURACY_NAVI = 5.0     # [m]
+GPS_ACCURACY_MIN = 3.0      # [m]
+GPS_ACCURACY_UNKNOWN = 50.0 # [m] a fix without accuracy (missing, 0 or negative) barely moves the fusion
+GPS_LATENCY_NAVI = 0.0      # [s]
+GPS_LATENCY_PHONE = 0.3     # [s] wifi/udp hop
+GPS_LATENCY_DEVICE = 0.1    # [s]
+
+
+def gps_accuracy(accuracy):
+  return max(accuracy, GPS_ACCURACY_MIN) if accuracy > 0 else GPS_ACCURACY_UNKNOWN
+
+# 7706 navi packet fields (the "nRoadLimitSpeed" branch of CarrotServ.update)
+F = carrot_wire.PacketField
+navi_packet_decoder = carrot_wire.FieldDecoder([
+  F("nSdiType", "nSdiType", int, -1),
+  F("nSdiSpeedLimit", "nSdiSpeedLimit", int, 0),
+  F("nSdiSection", "nSdiSection", int, -1),
+  F("nSdiDist", "nSdiDist", int, -1),
+  F("nSdiBlockType", "nSdiBlockType", int, -1),
+  F("nSdiBlockSpeed", "nSdiBlockSpeed", int, 0),
+  F("nSdiBlockDist", "nSdiBlockDist", int, 0),
+
+  F("nSdiPlusType", "nSdiPlusType", int, -1),
+  F("nSdiPlusSpeedLimit", "nSdiPlusSpeedLimit", int, 0),
+  F("nSdiPlusDist", "nSdiPlusDist", int, 0),
+  F("nSdiPlusBlockType", "nSdiPlusBlockType", int, -1),
+  F("nSdiPlusBlockSpeed", "nSdiPlusBlockSpeed", int, 0),
+  F("nSdiPlusBlockDist", "nSdiPlusBlockDist", int, 0),
+  F("roadcate", "roadcate", int, 0),
+
+  ## GuidePoint
+  F("nTBTDist", "nTBTDist", int, 0),
+  F("nTBTTurnType", "nTBTTurnType", int, -1),
+  F("szTBTMainText", "szTBTMainText", str, ""),
+  F("szNearDirName", "szNearDirName", str, ""),
+  F("szFarDirName", "szFarDirName", str, ""),
+
+  F("nTBTNextRoadWidth", "nTBTNextRoadWidth", int, 0),
+  F("nTBTDistNext", "nTBTDistNext", int, 0),
+  F("nTBTTurnTypeNext", "nTBTTurnTypeNext", int, -1),
+  F("szTBTMainText", "szTBTMainTextNext", str, ""),
+
+  F("nGoPosDist", "nGoPosDist", int, 0),
+  F("nGoPosTime", "nGoPosTime", int, 0),
+  F("szPosRoadName", "szPosRoadName", str, "", lambda v: "" if v == "null" else v),
+
+  F("vpPosPointLat", "vpPosPointLatNavi", float, 0.0),
+  F("vpPosPointLon", "vpPosPointLonNavi", float, 0.0),
+  F("nPosSpeed", "nPosSpeed", float, carrot_wire.KEEP),
+])
+del F
 
-nav_type_mapping = {
-  12: ("turn", "left", 1),
-  16: ("turn", "sharp left", 1),
-  1000: ("turn", "slight left", 1),
-  1001: ("turn", "slight right", 2),
-  1002: ("fork", "slight left", 3),
-  1003: ("fork", "slight right", 4),
-  1006: ("off ramp", "left", 3),
-  1007: ("off ramp", "right", 4),
-  13: ("turn", "right", 2),
-  19: ("turn", "sharp right", 2),
-  102: ("off ramp", "slight left", 3),
-  105: ("off ramp", "slight left", 3),
-  112: ("off ramp", "slight left", 3),
-  115: ("off ramp", "slight left", 3),
-  101: ("off ramp", "slight right", 4),
-  104: ("off ramp", "slight right", 4),
-  111: ("off ramp", "slight right", 4),
-  114: ("off ramp", "slight right", 4),
-  7: ("fork", "left", 3),
-  44: ("fork", "left", 3),
-  17: ("fork", "left", 3),
-  75: ("fork", "left", 3),
-  76: ("fork", "left", 3),
-  118: ("fork", "left", 3),
-  6: ("fork", "right", 4),
-  43: ("fork", "right", 4),
-  73: ("fork", "right", 4),
-  74: ("fork", "right", 4),
-  123: ("fork", "right", 4),
-  124: ("fork", "right", 4),
-  117: ("fork", "right", 4),
-  131: ("rotary", "slight right", 5),
-  132: ("rotary", "slight right", 5),
-  140: ("rotary", "slight left", 5),
-  141: ("rotary", "slight left", 5),
-  133: ("rotary", "right", 5),
-  134: ("rotary", "sharp right", 5),
-  135: ("rotary", "sharp right", 5),
-  136: ("rotary", "sharp left", 5),
-  137: ("rotary", "sharp left", 5),
-  138: ("rotary", "sharp left", 5),
-  139: ("rotary", "left", 5),
-  142: ("rotary", "straight", 5),
-  14: ("turn", "uturn", 5),
-  201: ("arrive", "straight", 5),
-  51: ("notification", "straight", None),
-  52: ("notification", "straight", None),
-  53: ("notification", "straight", None),
-  54: ("notification", "straight", None),
-  55: ("notification", "straight", None),
-  153: ("", "", 6),  #TG
-  154: ("", "", 6),  #TG
-  249: ("", "", 6)   #TG
-}
-
-import collections
 class CarrotServ:
   def __init__(self):
     self.params = Params()
     self.params_memory = Params("/dev/shm/params")
 
+    self.clock = time.monotonic   # replaced by carrot_replay
+    self.recorder = None
+    if os.getenv("CARROT_RECORD"):
+      from openpilot.selfdrive.carrot.carrot_replay import CarrotRecorder
+      self.recorder = CarrotRecorder(os.getenv("CARROT_RECORD"))
+
     self.nRoadLimitSpeed = 30
     self.nRoadLimitSpeed_last = 30
     self.nRoadLimitSpeed_counter = 0
@@ -142,6 +167,9 @@ class CarrotServ:
     self.last_update_gps_time_phone = 0
     self.last_update_gps_time_navi = 0
     self.bearing_offset = 0.0
+    self.gps_fusion = GpsFusion()
+    # navi/phone fixes arrive on the receiver thread; they are only queued there and fused on the tick
+    self.gps_fixes = collections.deque(maxlen=16)   # (t, lat, lon, accuracy, latency)
     self.bearing_measured = 0.0
     self.bearing = 0.0
     self.gps_valid = False
@@ -162,6 +190,8 @@ class CarrotServ:
     self.xTurnInfoNext = -1
     self.xDistToTurnNext = 0
 
+    self.hazards = HazardQueue()   # every reported camera/bump/section, not only the xSpd slot
+
     self.navType, self.navModifier = "invalid", ""
     self.navTypeNext, self.navModifierNext = "invalid", ""
 
@@ -169,9 +199,31 @@ class CarrotServ:
     self.carrotCmdIndex = 0
     self.carrotCmd = ""
     self.carrotArg = ""
-    self.carrotCmdIndex_last = 0
-
-    self.traffic_light_q = collections.deque(maxlen=int(2.0/0.1))  # 2 secnods
+    self.carrot_cmds = collections.deque(maxlen=32)   # (cmd, arg) of every received carrotCmd, handled on the tick
+
+    # navi/phone positions are converted into the WGS-84 of the device GPS ("gcj02" for Amap based apps)
+    self.navi_datum = DatumConverter(os.getenv("CARROT_NAVI_DATUM", DATUM_WGS84))
+
+    # naviPaths is re-encoded only when coords/distances change (checked by identity, see _update_route)
+    self.navi_paths_compact = os.getenv("CARROT_NAVI_PATHS") == "compact"
+    self.navi_paths_key = None
+    self.navi_paths = ""
+    self.route_s = 0.0                # along-route distance of the vehicle on naviPaths [m]
+    self.route_match_dist = -1.0      # distance to the route, -1 when not map matched
+    self.route_speeds = None
+    self.route_revision = 0
+    self.route_builder = MatcherBuilder()   # MapMatchers are built off the tick
+    self.route_matcher = None
+    self.route_xy = None              # route x/y of the vehicle at the last fix, None until anchored
+    self.route_frame = LocalFrame()   # ENU frame at the last fix
+    self.route_theta = 0.0            # rotation ENU -> route x/y [rad]
+
+    self.navi_delta = carrot_wire.DeltaReceiver()
+    self.navi_mailbox = carrot_wire.LatestMailbox()  # post_packet() -> applied at the next update_navi()
+
+    self.traffic_lights = TrafficLightTracker(radius=0.2, tau=1.0, window=2.0)
+    self.detect_frame_id = None
+    self.traffic_phase = TrafficPhasePredictor()
     self.traffic_light_count = -1
     self.traffic_state = 0
 
@@ -190,33 +242,41 @@ class CarrotServ:
     self.source_last = "none"
 
     self.debugText = ""
+    self.speed_arbiter = SpeedArbiter()
+    self.turn_plan_key = None
+    self.turn_plan = {}
+    self.turn_start_dist = 0.0
+    # target speed over the next 10s, time-shifted every tick and recomputed when the rows change
+    self.speed_profile = SpeedProfile(horizon=10., dt=0.5)
+    self.speed_trace = speed_trace
 
     # 默认语言，稍后在 update_params 中从 Params 读取覆盖，
     # 规则：main_ko -> 韩语；main_zh-CHS -> 中文；其他 -> 英文
     self.lang = "en"
 
+    # params는 변경될 때만 다시 읽음 (watcher가 version을 올림)
+    self.params_watcher = ParamsWatcher([self.params.get_param_path()])
+    self.params_version = -1
+    self.params_snapshot = None
     self.update_params()
 
+  def close(self):
+    """Stops the background threads (params watcher, route builder) and finalizes a recording."""
+    self.params_watcher.stop()
+    self.route_builder.stop()
+    if self.recorder is not None:
+      self.recorder.close()
+
   def update_params(self):
-    self.autoNaviSpeedBumpSpeed = float(self.params.get_int("AutoNaviSpeedBumpSpeed"))
-    self.autoNaviSpeedBumpTime = float(self.params.get_int("AutoNaviSpeedBumpTime"))
-    self.autoNaviSpeedCtrlEnd = float(self.params.get_int("AutoNaviSpeedCtrlEnd"))
-    self.autoNaviSpeedCtrlMode = self.params.get_int("AutoNaviSpeedCtrlMode")
-    self.autoNaviSpeedSafetyFactor = float(self.params.get_int("AutoNaviSpeedSafetyFactor")) * 0.01
-    self.autoNaviSpeedDecelRate = float(self.params.get_int("AutoNaviSpeedDecelRate")) * 0.01
-    self.autoNaviCountDownMode = self.params.get_int("AutoNaviCountDownMode")
-    self.turnSpeedControlMode= self.params.get_int("TurnSpeedControlMode")
-    self.mapTurnSpeedFactor= self.params.get_float("MapTurnSpeedFactor") * 0.01
-
-    self.autoTurnControlSpeedTurn = self.params.get_int("AutoTurnControlSpeedTurn")
-    self.autoTurnMapChange = self.params.get_int("AutoTurnMapChange")
-    self.autoTurnControl = self.params.get_int("AutoTurnControl")
-    self.autoTurnControlTurnEnd = self.params.get_int("AutoTurnControlTurnEnd")
-    #self.autoNaviSpeedDecelRate = float(self.params.get_int("AutoNaviSpeedDecelRate")) * 0.01
-    self.autoCurveSpeedLowerLimit = int(self.params.get("AutoCurveSpeedLowerLimit"))
-    self.is_metric = self.params.get_bool("IsMetric")
-    self.autoRoadSpeedLimitOffset = self.params.get_int("AutoRoadSpeedLimitOffset")
+    self.params_version = self.params_watcher.version
+    self.apply_params(self._load_params())
+
+  def apply_params(self, snapshot):
+    self.params_snapshot = snapshot
+    self.__dict__.update(snapshot._asdict())
+    self.sdi_descr = sdi_descr_table(self.lang)
 
+  def _load_params(self):
     # 读取语言设置：优先使用 LanguageSetting，与 UI 保持一致；回退读取可能存在的 "lang"
     try:
       lang_val = self.params.get('LanguageSetting', encoding='utf8') or self.params.get('lang', encoding='utf8')
@@ -228,94 +288,63 @@ class CarrotServ:
       except Exception:
         lang_val = None
     if lang_val == "main_ko":
-      self.lang = "ko"
+      lang = "ko"
     elif lang_val == "main_zh-CHS":
-      self.lang = "zh"
+      lang = "zh"
     else:
-      self.lang = "en"
+      lang = "en"
+
+    return CarrotServParams(
+      autoNaviSpeedBumpSpeed = float(self.params.get_int("AutoNaviSpeedBumpSpeed")),
+      autoNaviSpeedBumpTime = float(self.params.get_int("AutoNaviSpeedBumpTime")),
+      autoNaviSpeedCtrlEnd = float(self.params.get_int("AutoNaviSpeedCtrlEnd")),
+      autoNaviSpeedCtrlMode = self.params.get_int("AutoNaviSpeedCtrlMode"),
+      autoNaviSpeedSafetyFactor = float(self.params.get_int("AutoNaviSpeedSafetyFactor")) * 0.01,
+      autoNaviSpeedDecelRate = float(self.params.get_int("AutoNaviSpeedDecelRate")) * 0.01,
+      autoNaviCountDownMode = self.params.get_int("AutoNaviCountDownMode"),
+      turnSpeedControlMode = self.params.get_int("TurnSpeedControlMode"),
+      mapTurnSpeedFactor = self.params.get_float("MapTurnSpeedFactor") * 0.01,
+      autoTurnControlSpeedTurn = self.params.get_int("AutoTurnControlSpeedTurn"),
+      autoTurnMapChange = self.params.get_int("AutoTurnMapChange"),
+      autoTurnControl = self.params.get_int("AutoTurnControl"),
+      autoTurnControlTurnEnd = self.params.get_int("AutoTurnControlTurnEnd"),
+      autoCurveSpeedLowerLimit = int(self.params.get("AutoCurveSpeedLowerLimit")),
+      is_metric = self.params.get_bool("IsMetric"),
+      autoRoadSpeedLimitOffset = self.params.get_int("AutoRoadSpeedLimitOffset"),
+      lang = lang,
+    )
 
 
   def _update_cmd(self):
-    if self.carrotCmdIndex != self.carrotCmdIndex_last:
-      self.carrotCmdIndex_last = self.carrotCmdIndex
+    # every command since the last tick, not only the one left in the carrotCmd slot
+    cmds = self.carrot_cmds
+    while cmds:
+      cmd, arg = cmds.popleft()
       command_handlers = {
         "DETECT": self._handle_detect_command,
       }
 
-      handler = command_handlers.get(self.carrotCmd)
+      handler = command_handlers.get(cmd)
       if handler:
-        handler(self.carrotArg)
+        handler(arg)
 
-    self.traffic_light_q.append((-1, -1, "none", 0.0))
     self.traffic_light_count -= 1
     if self.traffic_light_count < 0:
       self.traffic_light_count = -1
       self.traffic_state = 0
 
   def _handle_detect_command(self, xArg):
-    elements = [e.strip() for e in xArg.split(',')]
-    if len(elements) >= 4:
-      try:
-        state = elements[0]
-        value1 = float(elements[1])
-        value2 = float(elements[2])
-        value3 = float(elements[3])
-        self.traffic_light(value1, value2, state, value3)
-        self.traffic_light_count = int(0.5 / 0.1)
-      except ValueError:
-        pass
-
-  def traffic_light(self, x, y, color, cnf):
-    traffic_red = 0
-    traffic_green = 0
-    traffic_left = 0
-    traffic_red_trig = 0
-    traffic_green_trig = 0
-    traffic_left_trig = 0
-    for pdata in self.traffic_light_q:
-      px, py, pcolor,pcnf = pdata
-      if abs(x - px) < 0.2 and abs(y - py) < 0.2:
-        if pcolor in ["Green Light", "Left turn"]:
-          if color in ["Red Light", "Yellow Light"]:
-            traffic_red_trig += cnf
-            traffic_red += cnf
-          elif color in ["Green Light", "Left turn"]:
-            traffic_green += cnf
-        elif pcolor in ["Red Light", "Yellow Light"]:
-          if color in ["Green Light"]: #, "Left turn"]:
-            traffic_green_trig += cnf
-            traffic_green += cnf
-          elif color in ["Left turn"]:
-            traffic_left_trig += cnf
-            traffic_left += cnf
-          elif color in ["Red Light", "Yellow Light"]:
-            traffic_red += cnf
-
-    #print(self.traffic_light_q)
-    if traffic_red_trig > 0:
-      self.traffic_state = 1
-      #self._add_log("Red light triggered")
-      #print("Red light triggered")
-    elif traffic_green_trig > 0 and traffic_green > traffic_red:  #주변에 red light의 cnf보다 더 크면 출발... 감지오류로 출발하는경우가 생김.
-      self.traffic_state = 2
-      #self._add_log("Green light triggered")
-      #print("Green light triggered")
-    elif traffic_left_trig > 0:
-      self.traffic_state = 3
-    elif traffic_red > 0:
-      self.traffic_state = 1
-      #self._add_log("Red light continued")
-      #print("Red light continued")
-    elif traffic_green > 0:
-      self.traffic_state = 2
-      #self._add_log("Green light continued")
-      #print("Green light continued")
-    else:
-      self.traffic_state = 0
-      #print("TrafficLight none")
-
-    self.traffic_light_q.append((x,y,color,cnf))
-
+    try:
+      frame_id, boxes = parse_detect(xArg)
+    except ValueError:
+      return
+    if len(boxes) == 0 or (frame_id is not None and frame_id == self.detect_frame_id):
+      return
+    self.detect_frame_id = frame_id
+    tracks = self.traffic_lights.observe_batch(self.clock(), boxes)
+    # the most confident light with a state decides; tracks are in descending confidence
+    self.traffic_state = next((t.state for t in tracks if t.state != TRAFFIC_NONE), TRAFFIC_NONE)
+    self.traffic_light_count = int(0.5 / 0.1)
 
   def calculate_current_speed(self, left_dist, safe_speed_kph, safe_time, safe_decel_rate):
     safe_speed = safe_speed_kph / 3.6
@@ -335,66 +364,8 @@ class CarrotServ:
     return max(safe_speed_kph, min(250, speed_mps * 3.6))
 
   def _update_tbt(self):
-    #xTurnInfo : 1: left turn, 2: right turn, 3: left lane change, 4: right lane change, 5: rotary, 6: tg, 7: arrive or uturn
-    turn_type_mapping = {
-      12: ("turn", "left", 1),
-      16: ("turn", "sharp left", 1),
-      13: ("turn", "right", 2),
-      19: ("turn", "sharp right", 2),
-      102: ("off ramp", "slight left", 3),
-      105: ("off ramp", "slight left", 3),
-      112: ("off ramp", "slight left", 3),
-      115: ("off ramp", "slight left", 3),
-      101: ("off ramp", "slight right", 4),
-      104: ("off ramp", "slight right", 4),
-      111: ("off ramp", "slight right", 4),
-      114: ("off ramp", "slight right", 4),
-      7: ("fork", "left", 3),
-      44: ("fork", "left", 3),
-      17: ("fork", "left", 3),
-      75: ("fork", "left", 3),
-      76: ("fork", "left", 3),
-      118: ("fork", "left", 3),
-      6: ("fork", "right", 4),
-      43: ("fork", "right", 4),
-      73: ("fork", "right", 4),
-      74: ("fork", "right", 4),
-      123: ("fork", "right", 4),
-      124: ("fork", "right", 4),
-      117: ("fork", "right", 4),
-      131: ("rotary", "slight right", 5),
-      132: ("rotary", "slight right", 5),
-      140: ("rotary", "slight left", 5),
-      141: ("rotary", "slight left", 5),
-      133: ("rotary", "right", 5),
-      134: ("rotary", "sharp right", 5),
-      135: ("rotary", "sharp right", 5),
-      136: ("rotary", "sharp left", 5),
-      137: ("rotary", "sharp left", 5),
-      138: ("rotary", "sharp left", 5),
-      139: ("rotary", "left", 5),
-      142: ("rotary", "straight", 5),
-      14: ("turn", "uturn", 7),
-      201: ("arrive", "straight", 8),
-      51: ("notification", "straight", 0),
-      52: ("notification", "straight", 0),
-      53: ("notification", "straight", 0),
-      54: ("notification", "straight", 0),
-      55: ("notification", "straight", 0),
-      153: ("", "", 6),  #TG
-      154: ("", "", 6),  #TG
-      249: ("", "", 6)   #TG
-    }
-
-    if self.nTBTTurnType in turn_type_mapping:
-      self.navType, self.navModifier, self.xTurnInfo = turn_type_mapping[self.nTBTTurnType]
-    else:
-      self.navType, self.navModifier, self.xTurnInfo = "invalid", "", -1
-
-    if self.nTBTTurnTypeNext in turn_type_mapping:
-      self.navTypeNext, self.navModifierNext, self.xTurnInfoNext = turn_type_mapping[self.nTBTTurnTypeNext]
-    else:
-      self.navTypeNext, self.navModifierNext, self.xTurnInfoNext = "invalid", "", -1
+    self.navType, self.navModifier, self.xTurnInfo = turn_type_mapping.get(self.nTBTTurnType, ("invalid", "", -1))
+    self.navTypeNext, self.navModifierNext, self.xTurnInfoNext = turn_type_mapping.get(self.nTBTTurnTypeNext, ("invalid", "", -1))
 
     if self.nTBTDist > 0 and self.xTurnInfo > 0:
       self.xDistToTurn = self.nTBTDist
@@ -413,284 +384,7 @@ class CarrotServ:
       else:
         return f"Update needed ({original_camera_type})"
 
-    # 多语言映射：ko（韩语，原始），zh（简体中文），en（英文）。
-    sdi_ko = {
-        0: "신호과속",
-        1: "과속 (고정식)",
-        2: "구간단속 시작",
-        3: "구간단속 끝",
-        4: "구간단속중",
-        5: "꼬리물기단속카메라",
-        6: "신호 단속",
-        7: "과속 (이동식)",
-        8: "고정식 과속위험 구간(박스형)",
-        9: "버스전용차로구간",
-        10: "가변 차로 단속",
-        11: "갓길 감시 지점",
-        12: "끼어들기 금지",
-        13: "교통정보 수집지점",
-        14: "방범용cctv",
-        15: "과적차량 위험구간",
-        16: "적재 불량 단속",
-        17: "주차단속 지점",
-        18: "일방통행도로",
-        19: "철길 건널목",
-        20: "어린이 보호구역(스쿨존 시작 구간)",
-        21: "어린이 보호구역(스쿨존 끝 구간)",
-        22: "과속방지턱",
-        23: "lpg충전소",
-        24: "터널 구간",
-        25: "휴게소",
-        26: "톨게이트",
-        27: "안개주의 지역",
-        28: "유해물질 지역",
-        29: "사고다발",
-        30: "급커브지역",
-        31: "급커브구간1",
-        32: "급경사구간",
-        33: "야생동물 교통사고 잦은 구간",
-        34: "우측시야불량지점",
-        35: "시야불량지점",
-        36: "좌측시야불량지점",
-        37: "신호위반다발구간",
-        38: "과속운행다발구간",
-        39: "교통혼잡지역",
-        40: "방향별차로선택지점",
-        41: "무단횡단사고다발지점",
-        42: "갓길 사고 다발 지점",
-        43: "과속 사발 다발 지점",
-        44: "졸음 사고 다발 지점",
-        45: "사고다발지점",
-        46: "보행자 사고다발지점",
-        47: "차량도난사고 상습발생지점",
-        48: "낙석주의지역",
-        49: "결빙주의지역",
-        50: "병목지점",
-        51: "합류 도로",
-        52: "추락주의지역",
-        53: "사고다발,주의위험",
-        54: "주택밀집지역(교통진정지역)",
-        55: "인터체인지",
-        56: "분기점",
-        57: "휴게소(lpg충전가능)",
-        58: "교량",
-        59: "제동장치사고다발지점",
-        60: "중앙선침범사고다발지점",
-        61: "통행위반사고다발지점",
-        62: "목적지 건너편 안내",
-        63: "졸음 쉼터 안내",
-        64: "노후경유차단속",
-        65: "터널내 차로변경단속",
-        66: "",
-        67: "터널",
-        68: "도선장",
-        69: "도로 양쪽 폭 좁음",
-        70: "도로 왼쪽 폭 좁음",
-        71: "도로 오른쪽 폭 좁음",
-        72: "좁은 다리",
-        73: "양쪽 우회",
-        74: "왼쪽 우회",
-        75: "오른쪽 우회",
-        76: "오른쪽 산길 위험",
-        77: "왼쪽 산길 위험",
-        78: "오르막 경사",
-        79: "내리막 경사",
-        80: "과수로",
-        81: "도로 불평탄",
-        82: "서행",
-        83: "횡풍 지역",
-        84: "추월금지",
-        85: "위반 다발지역",
-        86: "비차량전용차로 단속",
-    }
-
-    sdi_en = {
-        0: "Signal speed enforcement",
-        1: "Speed camera (fixed)",
-        2: "Section control start",
-        3: "Section control end",
-        4: "Under section control",
-        5: "Block-the-box camera",
-        6: "Signal violation enforcement",
-        7: "Speed camera (mobile)",
-        8: "Fixed speed camera zone (box)",
-        9: "Bus-only lane zone",
-        10: "Reversible/variable lane enforcement",
-        11: "Shoulder surveillance point",
-        12: "No cut-in",
-        13: "Traffic data collection point",
-        14: "Security CCTV",
-        15: "Overloaded vehicle risk zone",
-        16: "Improper loading enforcement",
-        17: "Parking enforcement point",
-        18: "One-way road",
-        19: "Railroad crossing",
-        20: "School zone start",
-        21: "School zone end",
-        22: "Speed bump",
-        23: "LPG station",
-        24: "Tunnel section",
-        25: "Rest area",
-        26: "Toll gate",
-        27: "Fog caution area",
-        28: "Hazardous materials area",
-        29: "Accident-prone section",
-        30: "Sharp curve area",
-        31: "Sharp curve section 1",
-        32: "Steep slope section",
-        33: "Wild animal crossing area",
-        34: "Poor visibility (right)",
-        35: "Poor visibility",
-        36: "Poor visibility (left)",
-        37: "Frequent signal violations",
-        38: "Frequent speeding",
-        39: "Traffic congestion area",
-        40: "Lane selection by direction",
-        41: "Frequent jaywalking accidents",
-        42: "Frequent shoulder accidents",
-        43: "Frequent speeding accidents",
-        44: "Frequent drowsy driving accidents",
-        45: "Accident-prone spot",
-        46: "Frequent pedestrian accidents",
-        47: "Frequent vehicle theft",
-        48: "Falling rock caution area",
-        49: "Icy road caution area",
-        50: "Bottleneck point",
-        51: "Merging road",
-        52: "Cliff/Drop caution area",
-        53: "Accident-prone, caution",
-        54: "Residential area (traffic calming)",
-        55: "Interchange",
-        56: "Junction",
-        57: "Rest area (LPG available)",
-        58: "Bridge",
-        59: "Frequent brake failure accidents",
-        60: "Center line invasion accidents",
-        61: "Violation-of-passage accidents",
-        62: "Destination on opposite side",
-        63: "Drowsy rest area",
-        64: "Old diesel control",
-        65: "Lane change enforcement in tunnel",
-        66: "",
-        67: "Tunnel",
-        68: "Ferry crossing",
-        69: "Road narrows on both sides",
-        70: "Road narrows on left",
-        71: "Road narrows on right",
-        72: "Narrow bridge",
-        73: "Detour (both sides)",
-        74: "Detour (left)",
-        75: "Detour (right)",
-        76: "Dangerous mountain road (right)",
-        77: "Dangerous mountain road (left)",
-        78: "Steep uphill",
-        79: "Steep downhill",
-        80: "Flooded road",
-        81: "Uneven road",
-        82: "Slow down",
-        83: "Crosswind area",
-        84: "No passing",
-        85: "Frequent violation area",
-        86: "Non-motorized lane enforcement",
-    }
-
-    sdi_zh = {
-        0: "常规摄像头拍照",
-        1: "限速拍照",
-        2: "区间测速开始",
-        3: "区间测速结束",
-        4: "区间测速中",
-        5: "路口压线拍照",
-        6: "闯红灯拍照",
-        7: "流动测速",
-        8: "测速拍照",
-        9: "公交专用道拍照",  # 高德官方：公交专用道拍照
-        10: "可变/车道拍照",
-        11: "应急车道拍照",
-        12: "禁止加塞",
-        13: "交通信息采集点",
-        14: "监控摄像",  # 高德官方：监控摄像
-        15: "超载车辆风险区",
-        16: "装载不当拍照",
-        17: "违停拍照点",
-        18: "未系安全带拍照",
-        19: "铁路道口",  # 高德官方：铁路道口（有人看管/无人看管）
-        20: "学校区域开始",  # 高德官方：学校
-        21: "学校区域结束",
-        22: "减速带",
-        23: "LPG加气站",
-        24: "隧道区间",
-        25: "服务区",
-        26: "ETC计费拍照",
-        27: "多雾路段",
-        28: "危险品区域",
-        29: "事故多发路段",
-        30: "急弯路段",  # 高德官方：向左急弯路/向右急弯路/反向弯路/连续弯路
-        31: "急弯区段1",
-        32: "陡坡路段",
-        33: "野生动物出没路段",
-        34: "右侧视野不良点",
-        35: "视野不良点",
-        36: "左侧视野不良点",
-        37: "闯红灯多发",
-        38: "超速多发",
-        39: "交通拥堵区域",
-        40: "按方向选择车道点",
-        41: "礼让行人拍照",
-        42: "应急车道事故多发",
-        43: "超速事故多发",
-        44: "疲劳驾驶事故多发",
-        45: "事故多发点",
-        46: "行人事故多发点",
-        47: "车辆盗窃多发点",
-        48: "落石危险路段",  # 高德官方：左侧落石/右侧落石
-        49: "路段易滑",  # 高德官方：路段易滑（原"路面结冰危险"不够准确）
-        50: "瓶颈路段",
-        51: "汇入道路",  # 高德官方：左侧车辆交汇处/右侧车辆交汇处
-        52: "坠落危险路段",
-        53: "事故易发地段",  # 高德官方：事故易发地段（原"事故多发,注意危险"调整为官方表述）
-        54: "村庄",  # 高德官方：村庄（原"居民区（交通缓和）"调整为官方表述）
-        55: "立交",
-        56: "分岔点",
-        57: "服务区（可加气）",
-        58: "桥梁",
-        59: "制动故障事故多发点",
-        60: "越线事故多发点",
-        61: "违法通行事故多发点",
-        62: "目的地在对面",
-        63: "瞌睡停车区",
-        64: "老旧柴油车管制",
-        65: "隧道内变道拍照",
-        66: "",
-        67: "隧道",  # 高德官方：隧道
-        68: "渡口",  # 高德官方：渡口
-        69: "道路两侧变窄",  # 高德官方：道路两侧变窄
-        70: "左侧变窄",  # 高德官方：左侧变窄
-        71: "右侧变窄",  # 高德官方：右侧变窄
-        72: "窄桥",  # 高德官方：窄桥
-        73: "左右绕行",  # 高德官方：左右绕行
-        74: "左侧绕行",  # 高德官方：左侧绕行
-        75: "右侧绕行",  # 高德官方：右侧绕行
-        76: "右侧靠山险路",  # 高德官方：右侧靠山险路
-        77: "左侧靠山险路",  # 高德官方：左侧靠山险路
-        78: "上陡坡",  # 高德官方：上陡坡
-        79: "下陡坡",  # 高德官方：下陡坡
-        80: "过水路面",  # 高德官方：过水路面
-        81: "路面不平",  # 高德官方：路面不平
-        82: "慢行",  # 高德官方：慢行
-        83: "横风区",  # 高德官方：横风区
-        84: "禁止超车",  # 高德官方：禁止超车
-        85: "违章高发地",  # 高德官方：违章高发地
-        86: "非机动车道拍照",  # 高德官方：非机动车道拍照
-    }
-
-    sdi_map = sdi_en
-    if self.lang == "ko":
-      sdi_map = sdi_ko
-    elif self.lang == "zh":
-      sdi_map = sdi_zh
-
-    return sdi_map.get(nSdiType, "")
+    return self.sdi_descr.get(nSdiType, "")
 
   def _update_sdi(self):
     #sdiBlockType
@@ -716,6 +410,40 @@ class CarrotServ:
       self.xSpdType = -1
       self.xSpdDist = 0
 
+  def _update_hazards(self):
+    hq = self.hazards
+    mode = self.autoNaviSpeedCtrlMode
+    for sdi_type, sdi_speed, sdi_dist in ((self.nSdiType, self.nSdiSpeedLimit, self.nSdiDist),
+                                          (self.nSdiPlusType, self.nSdiPlusSpeedLimit, self.nSdiPlusDist)):
+      if sdi_dist <= 0:
+        continue
+      if sdi_type in [0,1,2,3,4,7,8, 75, 76] and sdi_speed > 0 and mode > 0 and not (sdi_type == 7 and mode < 3):
+        hq.upsert(HAZARD_CAMERA, sdi_type, sdi_dist, sdi_speed * self.autoNaviSpeedSafetyFactor)
+      elif sdi_type == 22 and self.roadcate > 1 and mode >= 2:
+        hq.upsert(HAZARD_BUMP, sdi_type, sdi_dist, self.autoNaviSpeedBumpSpeed)
+
+    # section zones are gated like _update_sdi(): only behind a camera with a speed limit
+    if self.nSdiType in [0,1,2,3,4,7,8, 75, 76] and self.nSdiSpeedLimit > 0 and mode > 0 and \
+       self.nSdiBlockType in [2,3] and self.nSdiBlockDist > 0:
+      hq.upsert(HAZARD_SECTION, 4, self.nSdiBlockDist, self.nSdiSpeedLimit * self.autoNaviSpeedSafetyFactor)
+    hq.commit()
+
+  def _add_hazard_speeds(self, arbiter):
+    decel = self.autoNaviSpeedDecelRate
+    safe_time = max(self.autoNaviSpeedBumpTime, self.autoNaviSpeedCtrlEnd)
+    # beyond this an envelope is V_MAX_KPH even from the end of the speed profile horizon: cannot bind
+    v_max = V_MAX_KPH / 3.6
+    lookahead = self.speed_profile.t[-1] * 1.5   # the profile integrates 1.5x its horizon
+    horizon = v_max ** 2 / (2 * max(decel, 0.1)) + v_max * (safe_time + lookahead)
+    for dist, h in self.hazards.upcoming(horizon):
+      if dist > 0:
+        if h.kind == HAZARD_BUMP:
+          arbiter.add(dist, h.speed, self.autoNaviSpeedBumpTime, decel, "bump")
+        else:
+          arbiter.add(dist, h.speed, self.autoNaviSpeedCtrlEnd, decel, "cam")
+    for h in self.hazards.active_zones():
+      arbiter.add_speed(h.speed, "section")
+
   def _update_gps(self, v_ego, sm, gps_service):
     gps = sm[gps_service]
     #print(f"location = {sm.valid[llk]}, {sm.updated[llk]}, {sm.recv_frame[llk]}, {sm.recv_time[llk]}")
@@ -725,20 +453,20 @@ class CarrotServ:
     CC = sm['carControl']
     self.gps_valid = sm.updated[gps_service] and gps.hasFix
 
-    now = time.monotonic()
+    now = self.clock()
     gps_updated_phone = (now - self.last_update_gps_time_phone) < 3
     gps_updated_navi = (now - self.last_update_gps_time_navi) < 3
 
     bearing = self.nPosAngle
     if gps_updated_phone:
-      self.bearing_offset = 0.0
+      self.bearing_offset = self.gps_fusion.reset_bias()
     elif self.gps_valid:
       bearing = self.nPosAngle = gps.bearingDeg
       if self.gps_valid:
-        self.bearing_offset = 0.0
+        self.bearing_offset = self.gps_fusion.reset_bias()
       elif self.active_carrot > 0:
         bearing = self.nPosAnglePhone
-        self.bearing_offset = 0.0
+        self.bearing_offset = self.gps_fusion.reset_bias()
 
     #print(f"bearing = {bearing:.1f}, posA=={self.nPosAngle:.1f}, posP=={self.nPosAnglePhone:.1f}, offset={self.bearing_offset:.1f}, {gps_updated_phone}, {gps_updated_navi}")
     gpsDelayTimeAdjust = 0.0
@@ -747,10 +475,14 @@ class CarrotServ:
 
     external_gps_update_timedout = not (gps_updated_phone or gps_updated_navi)
     #print(f"gps_valid = {self.gps_valid}, bearing = {bearing:.1f}, pos = {location.positionGeodetic.value[0]:.6f}, {location.positionGeodetic.value[1]:.6f}")
+    while self.gps_fixes:
+      t, lat, lon, accuracy, latency = self.gps_fixes.popleft()
+      self.gps_fusion.update(now, lat, lon, accuracy, latency + max(now - t, 0.0))
     if self.gps_valid and external_gps_update_timedout:    # 내부GPS가 자동하고 carrotman으로부터 gps신호가 없는경우
       self.vpPosPointLatNavi = gps.latitude
       self.vpPosPointLonNavi = gps.longitude
       self.last_calculate_gps_time = now #sm.recv_time[llk]
+      self.gps_fusion.update(now, gps.latitude, gps.longitude, gps_accuracy(gps.horizontalAccuracy), GPS_LATENCY_DEVICE)
     elif gps_updated_navi:  # carrot navi로부터 gps신호가 수신되는 경우..
       if abs(self.bearing_measured - bearing) < 0.1:
           self.diff_angle_count += 1
@@ -759,21 +491,17 @@ class CarrotServ:
       self.bearing_measured = bearing
 
       if self.diff_angle_count > 5: # 조향각도변화가 거의 없을때만 업데이트
-        diff_angle = (self.nPosAngle - bearing) % 360
-        if diff_angle > 180:
-          diff_angle -= 360
-        self.bearing_offset = self.bearing_offset * 0.9 + diff_angle * 0.1
+        self.bearing_offset = self.gps_fusion.update_bias(angle_diff(self.nPosAngle, bearing), 9.0)
 
-    bearing_calculated = (bearing + self.bearing_offset) % 360
+    bearing_calculated = wrap360(bearing + self.bearing_offset)
 
     dt = now - self.last_calculate_gps_time
     #print(f"dt = {dt:.1f}, {self.vpPosPointLatNavi}, {self.vpPosPointLonNavi}")
     if dt > 5.0:
       self.vpPosPointLat, self.vpPosPointLon = 0.0, 0.0
-    elif dt == 0:
-      self.vpPosPointLat, self.vpPosPointLon = self.vpPosPointLatNavi, self.vpPosPointLonNavi
     else:
-      self.vpPosPointLat, self.vpPosPointLon = self.estimate_position(float(self.vpPosPointLatNavi), float(self.vpPosPointLonNavi), v_ego, bearing_calculated, dt + gpsDelayTimeAdjust)
+      # fused fixes + v_ego and yaw rate integrated in the local ENU frame
+      self.vpPosPointLat, self.vpPosPointLon, _ = self.gps_fusion.step(now + gpsDelayTimeAdjust, v_ego, bearing_calculated, CS.yawRate)
 
     #self.debugText = " {} {:.1f},{:.1f}={:.1f}+{:.1f}".format(self.active_sdi_count, self.nPosAngle, bearing_calculated, bearing, self.bearing_offset)
     #print("nPosAngle = {:.1f},{:.1f} = {:.1f}+{:.1f}".format(self.nPosAngle, bearing_calculated, bearing, self.bearing_offset))
@@ -782,44 +510,38 @@ class CarrotServ:
 
 
   def estimate_position(self, lat, lon, speed, angle, dt):
-    R = 6371000
-    angle_rad = math.radians(angle)
-    delta_d = speed * dt
-    delta_lat = delta_d * math.cos(angle_rad) / R
-    new_lat = lat + math.degrees(delta_lat)
-    delta_lon = delta_d * math.sin(angle_rad) / (R * math.cos(math.radians(lat)))
-    new_lon = lon + math.degrees(delta_lon)
+    return destination(lat, lon, speed * dt, angle)
 
-    return new_lat, new_lon
-
-  def update_auto_turn(self, v_ego_kph, sm, x_turn_info, x_dist_to_turn, check_steer=False):
+  def _turn_plan(self):
+    # (type, speed, dist, start) per xTurnInfo, rebuilt only when params, road limit or road width change
+    key = (self.params_version, self.nRoadLimitSpeed, self.nTBTNextRoadWidth)
+    if key == self.turn_plan_key:
+      return self.turn_plan
     turn_speed = self.autoTurnControlSpeedTurn
     fork_speed = self.nRoadLimitSpeed
     stop_speed = 1
     turn_dist_for_speed = self.autoTurnControlTurnEnd * turn_speed / 3.6 # 5
     fork_dist_for_speed = self.autoTurnControlTurnEnd * fork_speed / 3.6 # 5
     stop_dist_for_speed = 5
-    start_fork_dist = np.interp(self.nRoadLimitSpeed, [30, 50, 100], [160, 200, 350])
-    start_turn_dist = np.interp(self.nTBTNextRoadWidth, [5, 10], [43, 60])
-    turn_info_mapping = {
-        1: {"type": "turn left", "speed": turn_speed, "dist": turn_dist_for_speed, "start": start_fork_dist},
-        2: {"type": "turn right", "speed": turn_speed, "dist": turn_dist_for_speed, "start": start_fork_dist},
-        5: {"type": "straight", "speed": turn_speed, "dist": turn_dist_for_speed, "start": start_turn_dist},
-        3: {"type": "fork left", "speed": fork_speed, "dist": fork_dist_for_speed, "start": start_fork_dist},
-        4: {"type": "fork right", "speed": fork_speed, "dist": fork_dist_for_speed, "start": start_fork_dist},
-        6: {"type": "straight", "speed": fork_speed, "dist": fork_dist_for_speed, "start": start_fork_dist},
-        7: {"type": "straight", "speed": stop_speed, "dist": stop_dist_for_speed, "start": 1000},
-        8: {"type": "straight", "speed": stop_speed, "dist": stop_dist_for_speed, "start": 1000},
+    start_fork_dist = float(np.interp(self.nRoadLimitSpeed, [30, 50, 100], [160, 200, 350]))
+    start_turn_dist = float(np.interp(self.nTBTNextRoadWidth, [5, 10], [43, 60]))
+    self.turn_plan = {
+        1: ("turn left", turn_speed, turn_dist_for_speed, start_fork_dist),
+        2: ("turn right", turn_speed, turn_dist_for_speed, start_fork_dist),
+        5: ("straight", turn_speed, turn_dist_for_speed, start_turn_dist),
+        3: ("fork left", fork_speed, fork_dist_for_speed, start_fork_dist),
+        4: ("fork right", fork_speed, fork_dist_for_speed, start_fork_dist),
+        6: ("straight", fork_speed, fork_dist_for_speed, start_fork_dist),
+        7: ("straight", stop_speed, stop_dist_for_speed, 1000),
+        8: ("straight", stop_speed, stop_dist_for_speed, 1000),
     }
+    self.turn_start_dist = start_turn_dist
+    self.turn_plan_key = key
+    return self.turn_plan
 
-    default_mapping = {"type": "none", "speed": 0, "dist": 0, "start": 1000}
-
-    mapping = turn_info_mapping.get(x_turn_info, default_mapping)
-
-    atc_type = mapping["type"]
-    atc_speed = mapping["speed"]
-    atc_dist = mapping["dist"]
-    atc_start_dist = mapping["start"]
+  def update_auto_turn(self, v_ego_kph, sm, x_turn_info, x_dist_to_turn, check_steer=False):
+    atc_type, atc_speed, atc_dist, atc_start_dist = self._turn_plan().get(x_turn_info, _TURN_PLAN_NONE)
+    start_turn_dist = self.turn_start_dist
 
     if x_dist_to_turn > atc_start_dist:
       atc_type += " prepare"
@@ -858,14 +580,13 @@ class CarrotServ:
       if self.atc_paused:
         atc_type += " canceled"
 
-    atc_desired = 250
-    if atc_speed > 0 and x_dist_to_turn > 0:
-      decel = self.autoNaviSpeedDecelRate
-      safe_sec = 2.0
-      atc_desired = min(atc_desired, self.calculate_current_speed(x_dist_to_turn - atc_dist, atc_speed, safe_sec, decel))
-
+    return atc_type, atc_speed, atc_dist
 
-    return atc_desired, atc_type, atc_speed, atc_dist
+  def _add_turn_speed(self, arbiter, x_dist_to_turn, atc_speed, atc_dist, source):
+    if self.autoTurnControl in [2, 3] and atc_speed > 0 and x_dist_to_turn > 0:    # auto turn speed control
+      arbiter.add(x_dist_to_turn - atc_dist, atc_speed, 2.0, self.autoNaviSpeedDecelRate, source)
+    else:
+      arbiter.add_speed(250, source)
 
   def update_nav_instruction(self, sm):
     if sm.alive['navInstruction'] and sm.valid['navInstruction']:
@@ -877,16 +598,77 @@ class CarrotServ:
         self.nRoadLimitSpeed = max(30, round(msg_nav.speedLimit * CV.MS_TO_KPH))
       self.xDistToTurn = int(msg_nav.maneuverDistance)
       self.szTBTMainText = msg_nav.maneuverPrimaryText
-      self.xTurnInfo = -1
-      for key, value in nav_type_mapping.items():
-        if value[0] == msg_nav.maneuverType and value[1] == msg_nav.maneuverModifier:
-          self.xTurnInfo = value[2]
-          break
+      self.xTurnInfo = nav_type_reverse.get((msg_nav.maneuverType, msg_nav.maneuverModifier), -1)
 
       self.debugText = f"{self.nRoadLimitSpeed if self.is_metric else self.nRoadLimitSpeed * CV.KPH_TO_MPH:.0f},{msg_nav.maneuverType},{msg_nav.maneuverModifier} "
       #print(msg_nav)
       #print(f"navInstruction: {self.xTurnInfo}, {self.xDistToTurn}, {self.szTBTMainText}")
 
+  def _update_route(self, coords, distances, delta_dist):
+    # the caller hands over new lists when the route changes: the contents are only compared then,
+    # and a rebuilt but equal route keeps the along-route state
+    prev = self.navi_paths_key
+    if prev is not None and coords is prev[0] and distances is prev[1]:
+      changed = False
+    else:
+      self.navi_paths_key = (coords, distances)
+      changed = prev is None or coords != prev[0] or distances != prev[1]
+    if changed:
+      # the route starts at the vehicle: distance 0
+      self.route_s = 0.0
+      self.route_match_dist = -1.0
+      self.route_speeds = None
+      self.route_revision += 1
+      self.route_matcher = None
+      self.route_xy = None
+      if len(coords) >= 2:
+        self.route_builder.submit(self.route_revision, coords, distances)
+      if self.navi_paths_compact:
+        self.navi_paths = carrot_wire.encode_navi_paths_compact(coords, distances)
+      else:
+        self.navi_paths = carrot_wire.encode_navi_paths(coords, distances)
+      return
+
+    # odometry keeps the along-route distance advancing when there is no position to match
+    self.route_s += delta_dist
+    self.route_match_dist = -1.0
+    if len(coords) < 2:
+      return
+    matcher = self.route_matcher
+    if matcher is None:
+      matcher = self.route_matcher = self.route_builder.take(self.route_revision)
+      if matcher is None:
+        return
+    lat, lon = self.vpPosPointLat, self.vpPosPointLon
+    if lat == 0.0:
+      self.route_xy = None
+      return
+
+    # anchored at the previous fix: only the movement since then is rotated into the route frame, so
+    # an error in the rotation costs centimeters per tick instead of growing with the distance driven
+    route_heading = matcher.heading(max(self.route_s - 5.0, 0.0))
+    if self.route_xy is None:
+      self.route_theta = route_heading - bearing_to_heading(self.bearing)
+    else:
+      e, n = self.route_frame.to_enu(lat, lon)
+      c, s = math.cos(self.route_theta), math.sin(self.route_theta)
+      x0, y0 = self.route_xy
+      self.route_s, self.route_match_dist = matcher.match(x0 + c * e - s * n, y0 + s * e + c * n, self.route_s)
+      if self.route_match_dist >= 0.0 and e * e + n * n > 0.25:
+        # refine the rotation from the route direction at the match against the vehicle bearing
+        sample = route_heading - bearing_to_heading(self.bearing)
+        self.route_theta += 0.05 * math.remainder(sample - self.route_theta, math.tau)
+    self.route_xy = matcher.point(self.route_s)
+    self.route_frame.move(lat, lon)
+
+  def _route_curve_speed(self, v_ego, route_speed):
+    coords, distances = self.navi_paths_key
+    if len(coords) < 3:
+      return route_speed
+    if self.route_speeds is None or self.route_speeds.decel != self.autoNaviSpeedDecelRate:
+      self.route_speeds = RouteSpeed(coords, distances, self.autoNaviSpeedDecelRate)
+    return self.route_speeds.min_speed(self.route_s, max(v_ego * 2.0, 20.0))
+
   def update_kisa(self, data):
     self.active_kisa_count = 100
     if "kisawazecurrentspd" in data:
@@ -894,7 +676,7 @@ class CarrotServ:
     if "kisawazeroadspdlimit" in data:
       road_limit_speed = data["kisawazeroadspdlimit"]
       if road_limit_speed > 0:
-        print(f"kisawazeroadspdlimit: {road_limit_speed} km/h")
+        clog.log("kisa", "kisawazeroadspdlimit: {} km/h", road_limit_speed)
         if not self.is_metric:
           road_limit_speed *= CV.MPH_TO_KPH
         self.nRoadLimitSpeed = road_limit_speed
@@ -903,7 +685,7 @@ class CarrotServ:
     if "kisawazeendalert" in data:
       pass
     if "kisawazeroadname" in data:
-      print(f"kisawazeroadname: {data['kisawazeroadname']}")
+      clog.log("kisa", "kisawazeroadname: {}", data['kisawazeroadname'])
       self.szPosRoadName = data["kisawazeroadname"]
     if "kisawazereportid" in data and "kisawazealertdist" in data:
       id_str = data["kisawazereportid"]
@@ -913,7 +695,7 @@ class CarrotServ:
       distance = int(match.group(1)) if match else 0
       if not self.is_metric:
         distance = int(distance * 0.3048)
-      print(f"{id_str}: {distance} m")
+      clog.log("kisa", "{}: {} m", id_str, distance)
       xSpdType = -1
       if 'camera' in id_str:
         xSpdType = 101    # 101: waze speed cam, 100: police
@@ -930,7 +712,12 @@ class CarrotServ:
   def update_navi(self, remote_ip, sm, pm, vturn_speed, coords, distances, route_speed, gps_service):
 
     self.debugText = ""
-    self.update_params()
+    if self.params_watcher.version != self.params_version:
+      self.update_params()
+    for packet in self.navi_mailbox.take():
+      self.update(packet)
+    if self.recorder is not None:
+      self.recorder.record_tick(self.clock(), self, sm, remote_ip, vturn_speed, coords, distances, route_speed, gps_service)
     if sm.alive['carState'] and sm.alive['selfdriveState']:
       CS = sm['carState']
       v_ego = CS.vEgo
@@ -950,6 +737,7 @@ class CarrotServ:
     #self.bearing = self.nPosAngle #self._update_gps(v_ego, sm)
     self.bearing = self._update_gps(v_ego, sm, gps_service)
 
+    self.hazards.advance(delta_dist)
     self.xSpdDist = max(self.xSpdDist - delta_dist, -1000)
     self.xDistToTurn = self.xDistToTurn - delta_dist
     self.xDistToTurnNext = self.xDistToTurnNext - delta_dist
@@ -979,6 +767,7 @@ class CarrotServ:
       self.nTBTTurnType = self.nTBTTurnTypeNext = -1
       self.roadcate = 8
       self.nGoPosDist = 0
+      self.hazards.clear()
     if self.active_carrot <= 1 or self.active_kisa_count > 0:
       self.update_nav_instruction(sm)
 
@@ -992,30 +781,26 @@ class CarrotServ:
       self.xDistToTurnNext = 0
       self.xTurnInfoNext = -1
 
-    sdi_speed = 250
+    # sdi constraint: (dist, speed, safe_sec), dist 0 = flat speed
+    sdi_constraint = (0, 250, 0)
     hda_active = False
     ### 과속카메라, 사고방지턱
     if (self.xSpdDist > 0 or self.xSpdType in [100, 101]) and self.active_carrot > 0:
       safe_sec = self.autoNaviSpeedBumpTime if self.xSpdType == 22 else self.autoNaviSpeedCtrlEnd
-      decel = self.autoNaviSpeedDecelRate
-      sdi_speed = min(sdi_speed, self.calculate_current_speed(self.xSpdDist, self.xSpdLimit, safe_sec, decel))
+      sdi_constraint = (self.xSpdDist, self.xSpdLimit, safe_sec)
       self.active_carrot = 5 if self.xSpdType == 22 else 3
       if self.xSpdType == 4 or (self.xSpdType in [100, 101] and self.xSpdDist <= 0):
-        sdi_speed = self.xSpdLimit
+        sdi_constraint = (0, self.xSpdLimit, 0)
         self.active_carrot = 4
     elif CS is not None and CS.speedLimit > 0 and CS.speedLimitDistance > 0:
-      sdi_speed = min(sdi_speed,
-                      self.calculate_current_speed(CS.speedLimitDistance,
-                                                   CS.speedLimit * self.autoNaviSpeedSafetyFactor,
-                                                   self.autoNaviSpeedCtrlEnd,
-                                                   self.autoNaviSpeedDecelRate))
+      sdi_constraint = (CS.speedLimitDistance, CS.speedLimit * self.autoNaviSpeedSafetyFactor, self.autoNaviSpeedCtrlEnd)
       #self.active_carrot = 6
       hda_active = True
 
     #print(f"sdi_speed: {sdi_speed}, hda_active: {hda_active}, xSpdType: {self.xSpdType}, xSpdDist: {self.xSpdDist}, active_carrot: {self.active_carrot}, v_ego_kph: {v_ego_kph}, nRoadLimitSpeed: {self.nRoadLimitSpeed}")
     ### TBT 속도제어
-    atc_desired, self.atcType, self.atcSpeed, self.atcDist = self.update_auto_turn(v_ego*3.6, sm, self.xTurnInfo, self.xDistToTurn, True)
-    atc_desired_next, _, _, _ = self.update_auto_turn(v_ego*3.6, sm, self.xTurnInfoNext, self.xDistToTurnNext, False)
+    self.atcType, self.atcSpeed, self.atcDist = self.update_auto_turn(v_ego*3.6, sm, self.xTurnInfo, self.xDistToTurn, True)
+    _, atc_speed_next, atc_dist_next = self.update_auto_turn(v_ego*3.6, sm, self.xTurnInfoNext, self.xDistToTurnNext, False)
 
     if self.nSdiType  >= 0: # or self.active_carrot > 0:
       pass
@@ -1033,31 +818,33 @@ class CarrotServ:
       #self.debugText = ""
       pass
 
-    if self.autoTurnControl not in [2, 3]:    # auto turn speed control
-      atc_desired = atc_desired_next = 250
-
     if self.autoTurnControl not in [1,2]:    # auto turn control
       self.atcType = "none"
 
-
-    speed_n_sources = [
-      (atc_desired, "atc"),
-      (atc_desired_next, "atc2"),
-      (sdi_speed, "hda" if hda_active else "bump" if self.xSpdType == 22 else "section" if self.xSpdType == 4 else "police" if self.xSpdType == 100 else "waze" if self.xSpdType == 101 else "cam"),
-      (limit_speed, "road"),
-    ]
+    arbiter = self.speed_arbiter
+    arbiter.clear()
+    self._add_turn_speed(arbiter, self.xDistToTurn, self.atcSpeed, self.atcDist, "atc")
+    self._add_turn_speed(arbiter, self.xDistToTurnNext, atc_speed_next, atc_dist_next, "atc2")
+    sdi_source = "hda" if hda_active else "bump" if self.xSpdType == 22 else "section" if self.xSpdType == 4 else "police" if self.xSpdType == 100 else "waze" if self.xSpdType == 101 else "cam"
+    arbiter.add(*sdi_constraint, self.autoNaviSpeedDecelRate, sdi_source)
+    if self.active_carrot > 0:
+      self._add_hazard_speeds(arbiter)
+    arbiter.add_speed(limit_speed, "road")
     if self.turnSpeedControlMode in [1,2]:
-      speed_n_sources.append((max(abs(vturn_speed), self.autoCurveSpeedLowerLimit), "vturn"))
+      arbiter.add_speed(max(abs(vturn_speed), self.autoCurveSpeedLowerLimit), "vturn")
 
-    route_speed = max(route_speed * self.mapTurnSpeedFactor, self.autoCurveSpeedLowerLimit)
+    self._update_route(coords, distances, delta_dist)
+    route_speed = max(self._route_curve_speed(v_ego, route_speed) * self.mapTurnSpeedFactor, self.autoCurveSpeedLowerLimit)
     if self.turnSpeedControlMode == 2:
       if -500 < self.xDistToTurn < 500:
-        speed_n_sources.append((route_speed, "route"))
+        arbiter.add_speed(route_speed, "route")
     elif self.turnSpeedControlMode == 3:
-      speed_n_sources.append((route_speed, "route"))
+      arbiter.add_speed(route_speed, "route")
       #speed_n_sources.append((self.calculate_current_speed(dist, speed * self.mapTurnSpeedFactor, 0, 1.2), "route"))
 
-    desired_speed, source = min(speed_n_sources, key=lambda x: x[0])
+    desired_speed, source = arbiter.solve()
+    arbiter_source = source
+    self.speed_profile.update(self.clock(), self.totalDistance, v_ego, arbiter)
 
     if CS is not None:
       if source != self.source_last:
@@ -1076,6 +863,8 @@ class CarrotServ:
         desired_speed = self.gas_override_speed
 
       self.debugText += f"route={route_speed:.1f}"#f"desired={desired_speed:.1f},{source},g={self.gas_override_speed:.0f}"
+    self.speed_trace.record(self.clock(), v_ego_kph, arbiter, arbiter_source, desired_speed, source,
+                            self.gas_override_speed, self.gas_pressed_state)
 
     left_spd_sec = 100
     left_tbt_sec = 100
@@ -1113,6 +902,9 @@ class CarrotServ:
 
 
     self._update_cmd()
+    # learns red phases per light; nothing publishes a prediction yet, predict() is evaluated on demand
+    if self.vpPosPointLat != 0.0:
+      self.traffic_phase.update(self.clock(), self.vpPosPointLat, self.vpPosPointLon, self.bearing, self.traffic_state)
     msg = messaging.new_message('carrotMan')
     msg.valid = True
     msg.carrotMan.activeCarrot = self.active_carrot
@@ -1145,9 +937,7 @@ class CarrotServ:
     msg.carrotMan.nGoPosTime = self.nGoPosTime
     msg.carrotMan.szSdiDescr = self._get_sdi_descr(-1 if self.nSdiType == 0 and self.nSdiDist == 0 else self.nSdiType)
 
-    #coords_str = ";".join([f"{x},{y}" for x, y in coords])
-    coords_str = ";".join([f"{x:.2f},{y:.2f},{d:.2f}" for (x, y), d in zip(coords, distances, strict=False)])
-    msg.carrotMan.naviPaths = coords_str
+    msg.carrotMan.naviPaths = self.navi_paths
 
     msg.carrotMan.leftSec = int(self.carrot_left_sec)
     pm.send('carrotMan', msg)
@@ -1247,7 +1037,28 @@ class CarrotServ:
     except subprocess.CalledProcessError:
       print("timed.failed_setting_time")
 
+  def _decode_packet(self, data):
+    # 7706 packet: binary(carrot_wire) if it starts with the magic, otherwise JSON (older apps)
+    if carrot_wire.is_binary(data):
+      return carrot_wire.decode(data)
+    return json.loads(data)
+
+  def update_packet(self, data):
+    self.update(self._decode_packet(data))
+
+  def post_packet(self, data):
+    # called from the UDP receiver thread; only decodes, CarrotServ state is touched by update_navi()
+    packet = self.navi_delta.apply(self._decode_packet(data))
+    if packet is not None:
+      self.navi_mailbox.post(packet)
+
   def update(self, json):
+    if json is None:
+      return
+    now = self.clock()
+    if self.recorder is not None:
+      self.recorder.record_packet(now, json)
+    json = self.navi_delta.apply(json)
     if json is None:
       return
     if "carrotIndex" in json:
@@ -1268,10 +1079,10 @@ class CarrotServ:
       self.carrotCmdIndex = self.carrotIndex
       self.carrotCmd = json.get("carrotCmd")
       self.carrotArg = json.get("carrotArg")
-      print(f"carrotCmd = {self.carrotCmd}, {self.carrotArg}")
+      self.carrot_cmds.append((self.carrotCmd, self.carrotArg))
+      clog.log("cmd", "carrotCmd = {}, {}", self.carrotCmd, self.carrotArg)
 
     self.active_count = 80
-    now = time.monotonic()
 
     if "goalPosX" in json:
       self.goalPosX = float(json.get("goalPosX", self.goalPosX))
@@ -1298,55 +1109,20 @@ class CarrotServ:
       else:
         self.nRoadLimitSpeed_counter = 0
 
-      ### SDI
-      self.nSdiType = int(json.get("nSdiType", -1))
-      self.nSdiSpeedLimit = int(json.get("nSdiSpeedLimit", 0))
-      self.nSdiSection = int(json.get("nSdiSection", -1))
-      self.nSdiDist = int(json.get("nSdiDist", -1))
-      self.nSdiBlockType = int(json.get("nSdiBlockType", -1))
-      self.nSdiBlockSpeed = int(json.get("nSdiBlockSpeed", 0))
-      self.nSdiBlockDist = int(json.get("nSdiBlockDist", 0))
-
-      self.nSdiPlusType = int(json.get("nSdiPlusType", -1))
-      self.nSdiPlusSpeedLimit = int(json.get("nSdiPlusSpeedLimit", 0))
-      self.nSdiPlusDist = int(json.get("nSdiPlusDist", 0))
-      self.nSdiPlusBlockType = int(json.get("nSdiPlusBlockType", -1))
-      self.nSdiPlusBlockSpeed = int(json.get("nSdiPlusBlockSpeed", 0))
-      self.nSdiPlusBlockDist = int(json.get("nSdiPlusBlockDist", 0))
-      self.roadcate = int(json.get("roadcate", 0))
-
-      ## GuidePoint
-      self.nTBTDist = int(json.get("nTBTDist", 0))
-      self.nTBTTurnType = int(json.get("nTBTTurnType", -1))
-      self.szTBTMainText = json.get("szTBTMainText", "")
-      self.szNearDirName = json.get("szNearDirName", "")
-      self.szFarDirName = json.get("szFarDirName", "")
-
-      self.nTBTNextRoadWidth = int(json.get("nTBTNextRoadWidth", 0))
-      self.nTBTDistNext = int(json.get("nTBTDistNext", 0))
-      self.nTBTTurnTypeNext = int(json.get("nTBTTurnTypeNext", -1))
-      self.szTBTMainTextNext = json.get("szTBTMainText", "")
-
-      self.nGoPosDist = int(json.get("nGoPosDist", 0))
-      self.nGoPosTime = int(json.get("nGoPosTime", 0))
-      self.szPosRoadName = json.get("szPosRoadName", "")
-      if self.szPosRoadName == "null":
-        self.szPosRoadName = ""
-
-      self.vpPosPointLatNavi = float(json.get("vpPosPointLat", 0.0))
-      self.vpPosPointLonNavi = float(json.get("vpPosPointLon", 0.0))
+      navi_packet_decoder.decode_into(self, json)
       if self.vpPosPointLatNavi != 0.0:
         self.last_update_gps_time_navi = self.last_calculate_gps_time = now
+        if "vpPosPointLat" in json:
+          self.vpPosPointLatNavi, self.vpPosPointLonNavi = self.navi_datum.point(self.vpPosPointLatNavi, self.vpPosPointLonNavi)
+          self.gps_fixes.append((now, self.vpPosPointLatNavi, self.vpPosPointLonNavi, GPS_ACCURACY_NAVI, GPS_LATENCY_NAVI))
         self.nPosAngle = float(json.get("nPosAngle", self.nPosAngle))
 
-      self.nPosSpeed = float(json.get("nPosSpeed", self.nPosSpeed))
       self._update_tbt()
       self._update_sdi()
-      print(
-        f"sdi = {self.nSdiType}, {self.nSdiSpeedLimit}, {self.nSdiPlusType}, " +
-        f"tbt = {self.nTBTTurnType}, {self.nTBTDist}, " +
-        f"next = {self.nTBTTurnTypeNext}, {self.nTBTDistNext}"
-      )
+      self._update_hazards()
+      clog.log("navi", "sdi = {}, {}, {}, tbt = {}, {}, next = {}, {}",
+               self.nSdiType, self.nSdiSpeedLimit, self.nSdiPlusType,
+               self.nTBTTurnType, self.nTBTDist, self.nTBTTurnTypeNext, self.nTBTDistNext)
       #print(json)
     else:
       #print(json)
@@ -1357,9 +1133,14 @@ class CarrotServ:
       self.nPosAnglePhone = float(json.get("heading", self.nPosAngle))
       self.phone_latitude = float(json.get("latitude", self.vpPosPointLatNavi))
       self.phone_longitude = float(json.get("longitude", self.vpPosPointLonNavi))
+      if "longitude" in json:
+        self.phone_latitude, self.phone_longitude = self.navi_datum.point(self.phone_latitude, self.phone_longitude)
       self.phone_gps_accuracy = float(json.get("accuracy", 0))
       if self.phone_gps_accuracy < 15.0:
         self.phone_gps_frame += 1
+      if self.phone_latitude != 0.0:
+        self.gps_fixes.append((now, self.phone_latitude, self.phone_longitude,
+                               gps_accuracy(self.phone_gps_accuracy), GPS_LATENCY_PHONE))
       if (now - self.last_update_gps_time_navi) > 3.0:
         self.vpPosPointLatNavi = self.phone_latitude
         self.vpPosPointLonNavi = self.phone_longitude
@@ -1368,11 +1149,18 @@ class CarrotServ:
         # self.nPosSpeed = self.ve # TODO speed from v_ego
         self.last_update_gps_time_phone = self.last_calculate_gps_time = now
         self.nPosSpeed = float(json.get("gps_speed", 0))
-        print(f"phone gps: {self.vpPosPointLatNavi}, {self.vpPosPointLonNavi}, {self.phone_gps_accuracy}, {self.nPosSpeed}")
+        clog.log("phone_gps", "phone gps: {}, {}, {}, {}", self.vpPosPointLatNavi, self.vpPosPointLonNavi, self.phone_gps_accuracy, self.nPosSpeed)
 
 
 import traceback
 
+def _terminate(signum, _frame):
+  # the manager stops carrot_man with SIGTERM: finalize open recordings, atexit would not run
+  from openpilot.selfdrive.carrot.carrot_replay import close_recorders
+  close_recorders()
+  os._exit(128 + signum)
+
+
 def main():
   print("CarrotManager Started")
   #print("Carrot GitBranch = {}, {}".format(Params().get("GitBranch"), Params().get("GitCommitDate")))
@@ -1381,6 +1169,9 @@ def main():
   carrot_man = CarrotMan()
 
   print(f"CarrotMan {carrot_man}")
+  # kill -USR1 <pid> dumps the last 2 minutes of speed decisions
+  signal.signal(signal.SIGUSR1, lambda *_: print(f"speed trace: {speed_trace.dump(SPEED_TRACE_PATH)}"))
+  signal.signal(signal.SIGTERM, _terminate)
   threading.Thread(target=carrot_man.kisa_app_thread).start()
   while True:
     try:
@@ -1388,6 +1179,8 @@ def main():
     except Exception as e:
       print(f"carrot_man error...: {e}")
       traceback.print_exc()
+      print("\n".join(clog.dump(30)))
+      speed_trace.dump(SPEED_TRACE_PATH)
       time.sleep(10)
 
 
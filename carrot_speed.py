@@ -0,0 +1,219 @@
+import numpy as np
+
+V_MAX_KPH = 250.
+ARBITER_ROWS = 64   # initial SpeedArbiter capacity, also the rows a SpeedTrace tick keeps
+SPEED_TRACE_PATH = "/tmp/carrot_speed_trace.npz"   # SpeedTrace dump, see carrot_serv.main()
+
+
+def envelope_speed(left_dist, safe_speed_kph, safe_time, safe_decel_rate):
+  """Vectorized CarrotServ.calculate_current_speed(): allowed speed [kph] at left_dist [m] before a
+  constraint of safe_speed_kph, reached safe_time [s] before it with safe_decel_rate [m/s^2]."""
+  safe_speed = safe_speed_kph / 3.6
+  decel_dist = left_dist - safe_speed * safe_time
+  # v_i^2 = v_f^2 + 2ad
+  temp = safe_speed ** 2 + 2 * safe_decel_rate * decel_dist
+  speed = np.maximum(safe_speed_kph, np.minimum(V_MAX_KPH, np.sqrt(np.maximum(temp, 0.)) * 3.6))
+  return np.where(decel_dist <= 0, safe_speed_kph, speed)
+
+
+class SpeedArbiter:
+  """Collects speed constraints for one tick and returns the binding one.
+
+  Each row is (distance, target speed, safe time, decel rate, source). A flat speed (road limit,
+  vturn, ...) is a row at distance 0. All rows are evaluated in one vectorized envelope_speed() call;
+  ties resolve to the first row added, like min() over the old candidate list.
+  """
+  def __init__(self, capacity=ARBITER_ROWS):
+    self.dist = np.zeros(capacity)
+    self.speed = np.zeros(capacity)
+    self.safe_time = np.zeros(capacity)
+    self.decel = np.ones(capacity)
+    self.sources = [""] * capacity
+    self.n = 0
+    self.speeds = self.speed[:0]   # every row's speed [kph] of the last solve()
+    self.binding = -1              # row index of the last solve()'s result, -1 without rows
+
+  def clear(self):
+    self.n = 0
+
+  def add(self, dist, speed, safe_time, decel, source):
+    i = self.n
+    if i >= len(self.sources):
+      self._grow()
+    self.dist[i] = dist
+    self.speed[i] = speed
+    self.safe_time[i] = safe_time
+    self.decel[i] = decel
+    self.sources[i] = source
+    self.n = i + 1
+
+  def add_speed(self, speed, source):
+    self.add(0., speed, 0., 1., source)
+
+  def add_many(self, dist, speed, safe_time, decel, sources):
+    for row in zip(dist, speed, np.broadcast_to(safe_time, np.shape(dist)), np.broadcast_to(decel, np.shape(dist)), sources, strict=True):
+      self.add(*row)
+
+  def _grow(self):
+    cap = len(self.sources) * 2
+    for name in ("dist", "speed", "safe_time", "decel"):
+      arr = getattr(self, name)
+      grown = np.ones(cap) if name == "decel" else np.zeros(cap)
+      grown[:len(arr)] = arr
+      setattr(self, name, grown)
+    self.sources += [""] * (cap - len(self.sources))
+
+  def solve(self):
+    """Returns (speed, source) of the binding constraint; self.speeds keeps every row's speed."""
+    n = self.n
+    if n == 0:
+      self.binding = -1
+      return V_MAX_KPH, "none"
+    self.speeds = envelope_speed(self.dist[:n], self.speed[:n], self.safe_time[:n], self.decel[:n])
+    i = self.binding = int(np.argmin(self.speeds))
+    return float(self.speeds[i]), self.sources[i]
+
+
+class SpeedProfile:
+  """Jerk- and accel-limited target speed [kph] over the next `horizon` seconds, sampled every `dt`.
+
+  The profile is integrated against the ceiling of all arbiter rows along the road and cached with the
+  rows' absolute positions (odometer + dist). While the rows and the vehicle stay on the profile,
+  update() only time-shifts it; a recompute happens when a row moves, appears or disappears, when
+  v_ego drifts off the profile or when the cached part runs out.
+  """
+  def __init__(self, horizon=10., dt=0.5, a_max=1.5, a_min=-3.0, j_max=1.5, tau=1.5,
+               step=0.2, pos_tol=5., speed_tol=1., v_tol=1.5):
+    self.dt = dt
+    self.a_max, self.a_min, self.j_max, self.tau = a_max, a_min, j_max, tau
+    self.step = step
+    self.pos_tol, self.speed_tol, self.v_tol = pos_tol, speed_tol, v_tol
+    self.t = np.arange(int(round(horizon / dt)) + 1) * dt
+    # integrated over 1.5x the horizon so that shifting does not run past the end for horizon/2
+    self._t = np.arange(int(round(horizon * 1.5 / step)) + 1) * step
+    self._v = np.zeros(len(self._t))
+    self._rows = None
+    self.t0 = 0.
+    self.speeds = np.zeros(len(self.t), dtype=np.float32)
+    self.recomputes = 0
+
+  def update(self, now, odo, v_ego, arbiter):
+    """Returns self.speeds, the profile [kph] from `now` on."""
+    n = arbiter.n
+    rows = [(d + odo if d > 0 else -1., v, t, a) for d, v, t, a in
+            zip(arbiter.dist[:n].tolist(), arbiter.speed[:n].tolist(), arbiter.safe_time[:n].tolist(), arbiter.decel[:n].tolist())]
+    elapsed = now - self.t0
+    if (not self._same(rows) or elapsed < 0 or elapsed + self.t[-1] > self._t[-1] or
+        abs(np.interp(elapsed, self._t, self._v) - v_ego) > self.v_tol):
+      self._integrate(v_ego, arbiter.dist[:n], (arbiter.speed[:n], arbiter.safe_time[:n], arbiter.decel[:n]))
+      self._rows = rows
+      self.t0 = now
+      self.recomputes += 1
+      elapsed = 0.
+    self.speeds[:] = np.interp(elapsed + self.t, self._t, self._v) * 3.6
+    return self.speeds
+
+  def _same(self, rows):
+    cached = self._rows
+    if cached is None or len(rows) != len(cached):
+      return False
+    pos_tol, speed_tol = self.pos_tol, self.speed_tol
+    for (pos, v, t, a), (cpos, cv, ct, ca) in zip(rows, cached, strict=True):
+      if (pos < 0) != (cpos < 0) or abs(pos - cpos) > pos_tol or abs(v - cv) > speed_tol or t != ct or a != ca:
+        return False
+    return True
+
+  def ceiling(self, s, dist, rows):
+    """Allowed speed [kph] at the distances `s` ahead; a row stops binding once its point is passed."""
+    if len(dist) == 0:
+      return np.full(len(s), V_MAX_KPH)
+    speed, safe_time, decel = rows
+    left = dist[:, None] - s[None, :]
+    v = envelope_speed(left, speed[:, None], safe_time[:, None], decel[:, None])
+    v = np.where((dist[:, None] > 0) & (left < 0), V_MAX_KPH, v)
+    return v.min(axis=0)
+
+  def _integrate(self, v_ego, dist, rows):
+    s_max = max(v_ego, V_MAX_KPH / 3.6) * self._t[-1]
+    s = np.linspace(0., s_max, 256)
+    v_ceil = (self.ceiling(s, dist, rows) / 3.6).tolist()
+    last = len(v_ceil) - 1
+    inv_ds = 1. / s[1]
+    step, tau = self.step, self.tau
+    a_min, a_max, j = self.a_min, self.a_max, self.j_max * step
+    out = self._v
+    pos = 0.
+    v = v_ego
+    a = 0.
+    for k in range(len(out)):
+      out[k] = v
+      i = int((pos + v * tau) * inv_ds)   # look one time constant ahead
+      a_des = (v_ceil[i if i < last else last] - v) / tau
+      a_des = a_min if a_des < a_min else a_max if a_des > a_max else a_des
+      a = a - j if a_des < a - j else a + j if a_des > a + j else a_des
+      v += a * step
+      if v < 0.:
+        v = a = 0.
+      pos += v * step
+
+
+class SpeedTrace:
+  """Fixed-size ring of per-tick speed decisions: every arbiter row, the winner and the gas override.
+
+  record() only copies into preallocated arrays. dump() writes the ring, oldest tick first, as an
+  .npz file; source names are stored once in `sources` and referenced by index. A tick with more
+  than `max_rows` rows keeps the binding row in the last slot and counts the rest in `dropped`.
+  """
+  SCALARS = ("t", "v_ego", "desired", "gas_override", "gas_pressed")
+  CODES = ("rows", "winner", "source", "dropped")
+
+  def __init__(self, capacity=1200, max_rows=ARBITER_ROWS):
+    self.capacity = capacity
+    self.max_rows = max_rows
+    self.scalars = np.zeros((capacity, len(self.SCALARS)))
+    self.codes = np.zeros((capacity, len(self.CODES)), dtype=np.uint8)
+    self.speeds = np.zeros((capacity, max_rows), dtype=np.float32)
+    self.row_sources = np.zeros((capacity, max_rows), dtype=np.uint8)
+    self.sources = []
+    self._codes = {}
+    self.count = 0
+
+  def _code(self, source):
+    code = self._codes.get(source)
+    if code is None:
+      code = self._codes[source] = len(self.sources)
+      self.sources.append(source)
+    return code
+
+  def record(self, t, v_ego, arbiter, winner, desired, source, gas_override, gas_pressed):
+    i = self.count % self.capacity
+    n = min(arbiter.n, self.max_rows)
+    self.scalars[i] = (t, v_ego, desired, gas_override, gas_pressed)
+    self.speeds[i, :n] = arbiter.speeds[:n]
+    self.row_sources[i, :n] = [self._code(s) for s in arbiter.sources[:n]]
+    dropped = arbiter.n - n
+    if arbiter.binding >= n:
+      self.speeds[i, n - 1] = arbiter.speeds[arbiter.binding]
+      self.row_sources[i, n - 1] = self._code(arbiter.sources[arbiter.binding])
+    self.codes[i] = (n, self._code(winner), self._code(source), min(dropped, 255))
+    self.count += 1
+
+  def snapshot(self):
+    """The recorded ticks, oldest first, as a dict of arrays."""
+    n = min(self.count, self.capacity)
+    order = (np.arange(n) + self.count - n) % self.capacity
+    scalars, codes = self.scalars[order], self.codes[order]
+    out = {name: scalars[:, k] for k, name in enumerate(self.SCALARS)}
+    out.update({name: codes[:, k] for k, name in enumerate(self.CODES)})
+    out["gas_pressed"] = out["gas_pressed"] > 0
+    out["speeds"] = self.speeds[order]
+    out["row_sources"] = self.row_sources[order]
+    out["sources"] = np.array(self.sources)
+    return out
+
+  def dump(self, path):
+    np.savez(path, **self.snapshot())
+    return path
+
+
+speed_trace = SpeedTrace()
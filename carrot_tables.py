@@ -0,0 +1,410 @@
+import types
+
+# Lookup tables shared by CarrotServ. Built once at import (maneuver types) or lazily once per
+# language (SDI descriptions) and exposed read-only.
+
+# nTBTTurnType -> (navInstruction maneuverType, maneuverModifier, xTurnInfo)
+nav_type_mapping = types.MappingProxyType({
+  12: ("turn", "left", 1),
+  16: ("turn", "sharp left", 1),
+  1000: ("turn", "slight left", 1),
+  1001: ("turn", "slight right", 2),
+  1002: ("fork", "slight left", 3),
+  1003: ("fork", "slight right", 4),
+  1006: ("off ramp", "left", 3),
+  1007: ("off ramp", "right", 4),
+  13: ("turn", "right", 2),
+  19: ("turn", "sharp right", 2),
+  102: ("off ramp", "slight left", 3),
+  105: ("off ramp", "slight left", 3),
+  112: ("off ramp", "slight left", 3),
+  115: ("off ramp", "slight left", 3),
+  101: ("off ramp", "slight right", 4),
+  104: ("off ramp", "slight right", 4),
+  111: ("off ramp", "slight right", 4),
+  114: ("off ramp", "slight right", 4),
+  7: ("fork", "left", 3),
+  44: ("fork", "left", 3),
+  17: ("fork", "left", 3),
+  75: ("fork", "left", 3),
+  76: ("fork", "left", 3),
+  118: ("fork", "left", 3),
+  6: ("fork", "right", 4),
+  43: ("fork", "right", 4),
+  73: ("fork", "right", 4),
+  74: ("fork", "right", 4),
+  123: ("fork", "right", 4),
+  124: ("fork", "right", 4),
+  117: ("fork", "right", 4),
+  131: ("rotary", "slight right", 5),
+  132: ("rotary", "slight right", 5),
+  140: ("rotary", "slight left", 5),
+  141: ("rotary", "slight left", 5),
+  133: ("rotary", "right", 5),
+  134: ("rotary", "sharp right", 5),
+  135: ("rotary", "sharp right", 5),
+  136: ("rotary", "sharp left", 5),
+  137: ("rotary", "sharp left", 5),
+  138: ("rotary", "sharp left", 5),
+  139: ("rotary", "left", 5),
+  142: ("rotary", "straight", 5),
+  14: ("turn", "uturn", 5),
+  201: ("arrive", "straight", 5),
+  51: ("notification", "straight", None),
+  52: ("notification", "straight", None),
+  53: ("notification", "straight", None),
+  54: ("notification", "straight", None),
+  55: ("notification", "straight", None),
+  153: ("", "", 6),  #TG
+  154: ("", "", 6),  #TG
+  249: ("", "", 6)   #TG
+})
+
+# (maneuverType, maneuverModifier) -> xTurnInfo, first match in nav_type_mapping order
+nav_type_reverse = {}
+for _value in nav_type_mapping.values():
+  nav_type_reverse.setdefault(_value[:2], _value[2])
+nav_type_reverse = types.MappingProxyType(nav_type_reverse)
+del _value
+
+#xTurnInfo : 1: left turn, 2: right turn, 3: left lane change, 4: right lane change, 5: rotary, 6: tg, 7: arrive or uturn
+turn_type_mapping = types.MappingProxyType({
+  12: ("turn", "left", 1),
+  16: ("turn", "sharp left", 1),
+  13: ("turn", "right", 2),
+  19: ("turn", "sharp right", 2),
+  102: ("off ramp", "slight left", 3),
+  105: ("off ramp", "slight left", 3),
+  112: ("off ramp", "slight left", 3),
+  115: ("off ramp", "slight left", 3),
+  101: ("off ramp", "slight right", 4),
+  104: ("off ramp", "slight right", 4),
+  111: ("off ramp", "slight right", 4),
+  114: ("off ramp", "slight right", 4),
+  7: ("fork", "left", 3),
+  44: ("fork", "left", 3),
+  17: ("fork", "left", 3),
+  75: ("fork", "left", 3),
+  76: ("fork", "left", 3),
+  118: ("fork", "left", 3),
+  6: ("fork", "right", 4),
+  43: ("fork", "right", 4),
+  73: ("fork", "right", 4),
+  74: ("fork", "right", 4),
+  123: ("fork", "right", 4),
+  124: ("fork", "right", 4),
+  117: ("fork", "right", 4),
+  131: ("rotary", "slight right", 5),
+  132: ("rotary", "slight right", 5),
+  140: ("rotary", "slight left", 5),
+  141: ("rotary", "slight left", 5),
+  133: ("rotary", "right", 5),
+  134: ("rotary", "sharp right", 5),
+  135: ("rotary", "sharp right", 5),
+  136: ("rotary", "sharp left", 5),
+  137: ("rotary", "sharp left", 5),
+  138: ("rotary", "sharp left", 5),
+  139: ("rotary", "left", 5),
+  142: ("rotary", "straight", 5),
+  14: ("turn", "uturn", 7),
+  201: ("arrive", "straight", 8),
+  51: ("notification", "straight", 0),
+  52: ("notification", "straight", 0),
+  53: ("notification", "straight", 0),
+  54: ("notification", "straight", 0),
+  55: ("notification", "straight", 0),
+  153: ("", "", 6),  #TG
+  154: ("", "", 6),  #TG
+  249: ("", "", 6)   #TG
+})
+
+
+# SDI descriptions: ko (韩语，原始), zh (简体中文), en (英文)
+def _sdi_ko():
+  return {
+    0: "신호과속",
+    1: "과속 (고정식)",
+    2: "구간단속 시작",
+    3: "구간단속 끝",
+    4: "구간단속중",
+    5: "꼬리물기단속카메라",
+    6: "신호 단속",
+    7: "과속 (이동식)",
+    8: "고정식 과속위험 구간(박스형)",
+    9: "버스전용차로구간",
+    10: "가변 차로 단속",
+    11: "갓길 감시 지점",
+    12: "끼어들기 금지",
+    13: "교통정보 수집지점",
+    14: "방범용cctv",
+    15: "과적차량 위험구간",
+    16: "적재 불량 단속",
+    17: "주차단속 지점",
+    18: "일방통행도로",
+    19: "철길 건널목",
+    20: "어린이 보호구역(스쿨존 시작 구간)",
+    21: "어린이 보호구역(스쿨존 끝 구간)",
+    22: "과속방지턱",
+    23: "lpg충전소",
+    24: "터널 구간",
+    25: "휴게소",
+    26: "톨게이트",
+    27: "안개주의 지역",
+    28: "유해물질 지역",
+    29: "사고다발",
+    30: "급커브지역",
+    31: "급커브구간1",
+    32: "급경사구간",
+    33: "야생동물 교통사고 잦은 구간",
+    34: "우측시야불량지점",
+    35: "시야불량지점",
+    36: "좌측시야불량지점",
+    37: "신호위반다발구간",
+    38: "과속운행다발구간",
+    39: "교통혼잡지역",
+    40: "방향별차로선택지점",
+    41: "무단횡단사고다발지점",
+    42: "갓길 사고 다발 지점",
+    43: "과속 사발 다발 지점",
+    44: "졸음 사고 다발 지점",
+    45: "사고다발지점",
+    46: "보행자 사고다발지점",
+    47: "차량도난사고 상습발생지점",
+    48: "낙석주의지역",
+    49: "결빙주의지역",
+    50: "병목지점",
+    51: "합류 도로",
+    52: "추락주의지역",
+    53: "사고다발,주의위험",
+    54: "주택밀집지역(교통진정지역)",
+    55: "인터체인지",
+    56: "분기점",
+    57: "휴게소(lpg충전가능)",
+    58: "교량",
+    59: "제동장치사고다발지점",
+    60: "중앙선침범사고다발지점",
+    61: "통행위반사고다발지점",
+    62: "목적지 건너편 안내",
+    63: "졸음 쉼터 안내",
+    64: "노후경유차단속",
+    65: "터널내 차로변경단속",
+    66: "",
+    67: "터널",
+    68: "도선장",
+    69: "도로 양쪽 폭 좁음",
+    70: "도로 왼쪽 폭 좁음",
+    71: "도로 오른쪽 폭 좁음",
+    72: "좁은 다리",
+    73: "양쪽 우회",
+    74: "왼쪽 우회",
+    75: "오른쪽 우회",
+    76: "오른쪽 산길 위험",
+    77: "왼쪽 산길 위험",
+    78: "오르막 경사",
+    79: "내리막 경사",
+    80: "과수로",
+    81: "도로 불평탄",
+    82: "서행",
+    83: "횡풍 지역",
+    84: "추월금지",
+    85: "위반 다발지역",
+    86: "비차량전용차로 단속",
+  }
+
+
+def _sdi_en():
+  return {
+    0: "Signal speed enforcement",
+    1: "Speed camera (fixed)",
+    2: "Section control start",
+    3: "Section control end",
+    4: "Under section control",
+    5: "Block-the-box camera",
+    6: "Signal violation enforcement",
+    7: "Speed camera (mobile)",
+    8: "Fixed speed camera zone (box)",
+    9: "Bus-only lane zone",
+    10: "Reversible/variable lane enforcement",
+    11: "Shoulder surveillance point",
+    12: "No cut-in",
+    13: "Traffic data collection point",
+    14: "Security CCTV",
+    15: "Overloaded vehicle risk zone",
+    16: "Improper loading enforcement",
+    17: "Parking enforcement point",
+    18: "One-way road",
+    19: "Railroad crossing",
+    20: "School zone start",
+    21: "School zone end",
+    22: "Speed bump",
+    23: "LPG station",
+    24: "Tunnel section",
+    25: "Rest area",
+    26: "Toll gate",
+    27: "Fog caution area",
+    28: "Hazardous materials area",
+    29: "Accident-prone section",
+    30: "Sharp curve area",
+    31: "Sharp curve section 1",
+    32: "Steep slope section",
+    33: "Wild animal crossing area",
+    34: "Poor visibility (right)",
+    35: "Poor visibility",
+    36: "Poor visibility (left)",
+    37: "Frequent signal violations",
+    38: "Frequent speeding",
+    39: "Traffic congestion area",
+    40: "Lane selection by direction",
+    41: "Frequent jaywalking accidents",
+    42: "Frequent shoulder accidents",
+    43: "Frequent speeding accidents",
+    44: "Frequent drowsy driving accidents",
+    45: "Accident-prone spot",
+    46: "Frequent pedestrian accidents",
+    47: "Frequent vehicle theft",
+    48: "Falling rock caution area",
+    49: "Icy road caution area",
+    50: "Bottleneck point",
+    51: "Merging road",
+    52: "Cliff/Drop caution area",
+    53: "Accident-prone, caution",
+    54: "Residential area (traffic calming)",
+    55: "Interchange",
+    56: "Junction",
+    57: "Rest area (LPG available)",
+    58: "Bridge",
+    59: "Frequent brake failure accidents",
+    60: "Center line invasion accidents",
+    61: "Violation-of-passage accidents",
+    62: "Destination on opposite side",
+    63: "Drowsy rest area",
+    64: "Old diesel control",
+    65: "Lane change enforcement in tunnel",
+    66: "",
+    67: "Tunnel",
+    68: "Ferry crossing",
+    69: "Road narrows on both sides",
+    70: "Road narrows on left",
+    71: "Road narrows on right",
+    72: "Narrow bridge",
+    73: "Detour (both sides)",
+    74: "Detour (left)",
+    75: "Detour (right)",
+    76: "Dangerous mountain road (right)",
+    77: "Dangerous mountain road (left)",
+    78: "Steep uphill",
+    79: "Steep downhill",
+    80: "Flooded road",
+    81: "Uneven road",
+    82: "Slow down",
+    83: "Crosswind area",
+    84: "No passing",
+    85: "Frequent violation area",
+    86: "Non-motorized lane enforcement",
+  }
+
+
+def _sdi_zh():
+  return {
+    0: "常规摄像头拍照",
+    1: "限速拍照",
+    2: "区间测速开始",
+    3: "区间测速结束",
+    4: "区间测速中",
+    5: "路口压线拍照",
+    6: "闯红灯拍照",
+    7: "流动测速",
+    8: "测速拍照",
+    9: "公交专用道拍照",  # 高德官方：公交专用道拍照
+    10: "可变/车道拍照",
+    11: "应急车道拍照",
+    12: "禁止加塞",
+    13: "交通信息采集点",
+    14: "监控摄像",  # 高德官方：监控摄像
+    15: "超载车辆风险区",
+    16: "装载不当拍照",
+    17: "违停拍照点",
+    18: "未系安全带拍照",
+    19: "铁路道口",  # 高德官方：铁路道口（有人看管/无人看管）
+    20: "学校区域开始",  # 高德官方：学校
+    21: "学校区域结束",
+    22: "减速带",
+    23: "LPG加气站",
+    24: "隧道区间",
+    25: "服务区",
+    26: "ETC计费拍照",
+    27: "多雾路段",
+    28: "危险品区域",
+    29: "事故多发路段",
+    30: "急弯路段",  # 高德官方：向左急弯路/向右急弯路/反向弯路/连续弯路
+    31: "急弯区段1",
+    32: "陡坡路段",
+    33: "野生动物出没路段",
+    34: "右侧视野不良点",
+    35: "视野不良点",
+    36: "左侧视野不良点",
+    37: "闯红灯多发",
+    38: "超速多发",
+    39: "交通拥堵区域",
+    40: "按方向选择车道点",
+    41: "礼让行人拍照",
+    42: "应急车道事故多发",
+    43: "超速事故多发",
+    44: "疲劳驾驶事故多发",
+    45: "事故多发点",
+    46: "行人事故多发点",
+    47: "车辆盗窃多发点",
+    48: "落石危险路段",  # 高德官方：左侧落石/右侧落石
+    49: "路段易滑",  # 高德官方：路段易滑（原"路面结冰危险"不够准确）
+    50: "瓶颈路段",
+    51: "汇入道路",  # 高德官方：左侧车辆交汇处/右侧车辆交汇处
+    52: "坠落危险路段",
+    53: "事故易发地段",  # 高德官方：事故易发地段（原"事故多发,注意危险"调整为官方表述）
+    54: "村庄",  # 高德官方：村庄（原"居民区（交通缓和）"调整为官方表述）
+    55: "立交",
+    56: "分岔点",
+    57: "服务区（可加气）",
+    58: "桥梁",
+    59: "制动故障事故多发点",
+    60: "越线事故多发点",
+    61: "违法通行事故多发点",
+    62: "目的地在对面",
+    63: "瞌睡停车区",
+    64: "老旧柴油车管制",
+    65: "隧道内变道拍照",
+    66: "",
+    67: "隧道",  # 高德官方：隧道
+    68: "渡口",  # 高德官方：渡口
+    69: "道路两侧变窄",  # 高德官方：道路两侧变窄
+    70: "左侧变窄",  # 高德官方：左侧变窄
+    71: "右侧变窄",  # 高德官方：右侧变窄
+    72: "窄桥",  # 高德官方：窄桥
+    73: "左右绕行",  # 高德官方：左右绕行
+    74: "左侧绕行",  # 高德官方：左侧绕行
+    75: "右侧绕行",  # 高德官方：右侧绕行
+    76: "右侧靠山险路",  # 高德官方：右侧靠山险路
+    77: "左侧靠山险路",  # 高德官方：左侧靠山险路
+    78: "上陡坡",  # 高德官方：上陡坡
+    79: "下陡坡",  # 高德官方：下陡坡
+    80: "过水路面",  # 高德官方：过水路面
+    81: "路面不平",  # 高德官方：路面不平
+    82: "慢行",  # 高德官方：慢行
+    83: "横风区",  # 高德官方：横风区
+    84: "禁止超车",  # 高德官方：禁止超车
+    85: "违章高发地",  # 高德官方：违章高发地
+    86: "非机动车道拍照",  # 高德官方：非机动车道拍照
+  }
+
+
+_sdi_builders = {"ko": _sdi_ko, "en": _sdi_en, "zh": _sdi_zh}
+_sdi_tables = {}
+
+
+def sdi_descr_table(lang):
+  """nSdiType -> description for lang ("ko", "zh", otherwise "en"), built on first use."""
+  if lang not in _sdi_builders:
+    lang = "en"
+  table = _sdi_tables.get(lang)
+  if table is None:
+    table = _sdi_tables[lang] = types.MappingProxyType(_sdi_builders[lang]())
+  return table
@@ -0,0 +1,174 @@
+import math
+
+import numpy as np
+
+TRAFFIC_NONE = 0
+TRAFFIC_RED = 1
+TRAFFIC_GREEN = 2
+TRAFFIC_LEFT = 3
+
+# DETECT box colors; batched boxes carry the index into this table
+TRAFFIC_COLORS = ("none", "Red Light", "Yellow Light", "Green Light", "Left turn")
+TRAFFIC_COLOR_CODES = {c: i for i, c in enumerate(TRAFFIC_COLORS)}
+
+_RED_COLORS = ("Red Light", "Yellow Light")
+_GREEN_COLORS = ("Green Light", "Left turn")
+
+
+def parse_detect(arg):
+  """Parses a DETECT carrotArg into (frame id or None, (N, 4) array of (color code, x, y, cnf)).
+
+    "Red Light, 0.5, 0.4, 0.8"                                     one box (older phone apps)
+    "1234|Red Light,0.5,0.4,0.8;Left turn,0.6,0.4,0.7"             one camera frame, N boxes
+
+  Raises ValueError on a malformed box.
+  """
+  frame_id = None
+  if "|" in arg:
+    head, arg = arg.split("|", 1)
+    frame_id = int(head)
+  rows = []
+  for box in arg.split(";"):
+    elements = box.split(",")
+    if len(elements) < 4:
+      if box.strip():
+        raise ValueError(f"bad DETECT box: {box!r}")
+      continue
+    rows.append((TRAFFIC_COLOR_CODES.get(elements[0].strip(), 0), float(elements[1]), float(elements[2]), float(elements[3])))
+  return frame_id, np.array(rows, dtype=float).reshape(-1, 4)
+
+
+class TrafficLightTrack:
+  __slots__ = ("id", "x", "y", "cell", "color", "cnf", "red", "green", "last_seen", "state")
+
+  def __init__(self, track_id, x, y, cell):
+    self.id = track_id
+    self.x = x
+    self.y = y
+    self.cell = cell
+    self.color = "none"
+    self.cnf = 0.0
+    self.red = 0.0     # decayed count of earlier red/yellow detections
+    self.green = 0.0   # decayed count of earlier green/left detections
+    self.last_seen = 0.0
+    self.state = TRAFFIC_NONE
+
+
+class TrafficLightTracker:
+  """Traffic lights from DETECT boxes, tracked by image position.
+
+  A detection is associated with the nearest track within `radius` (normalized image coordinates)
+  found in the 3x3 grid cells around it, so the lookup does not depend on history length or on the
+  number of lights elsewhere in the frame. Each track keeps the red and green detections it has seen,
+  decayed with `tau` [s], and is dropped `window` [s] after its last detection.
+  """
+  def __init__(self, radius=0.2, tau=1.0, window=2.0):
+    self.radius = radius
+    self.tau = tau
+    self.window = window
+    self.tracks = {}
+    self.grid = {}
+    self.next_id = 0
+
+  def _cell(self, x, y):
+    return int(math.floor(x / self.radius)), int(math.floor(y / self.radius))
+
+  def _find(self, x, y, claimed=()):
+    cx, cy = self._cell(x, y)
+    best, best_d = None, None
+    for gx in (cx - 1, cx, cx + 1):
+      for gy in (cy - 1, cy, cy + 1):
+        for track in self.grid.get((gx, gy), ()):
+          if track.id in claimed:
+            continue
+          dx, dy = abs(track.x - x), abs(track.y - y)
+          if dx < self.radius and dy < self.radius and (best is None or dx + dy < best_d):
+            best, best_d = track, dx + dy
+    return best
+
+  def _move(self, track, x, y):
+    track.x, track.y = x, y
+    cell = self._cell(x, y)
+    if cell != track.cell:
+      self._unlink(track)
+      track.cell = cell
+      self.grid.setdefault(cell, []).append(track)
+
+  def _unlink(self, track):
+    bucket = self.grid[track.cell]
+    bucket.remove(track)
+    if not bucket:
+      del self.grid[track.cell]
+
+  def expire(self, now):
+    if not self.tracks:
+      return
+    for track in [t for t in self.tracks.values() if now - t.last_seen > self.window]:
+      del self.tracks[track.id]
+      self._unlink(track)
+
+  def observe(self, now, x, y, color, cnf):
+    """Associates one detection and returns its track; track.state is the TRAFFIC_* state it implies."""
+    self.expire(now)
+    return self._observe(now, x, y, color, cnf)
+
+  def observe_batch(self, now, boxes):
+    """Associates all boxes of one frame, an (N, 4) array of (color code, x, y, cnf).
+
+    Boxes are taken in descending confidence and a track takes at most one box per frame.
+    Returns the tracks in that order.
+    """
+    self.expire(now)
+    claimed = set()
+    tracks = []
+    for code, x, y, cnf in boxes[(-boxes[:, 3]).argsort(kind="stable")].tolist():
+      track = self._observe(now, x, y, TRAFFIC_COLORS[int(code)], cnf, claimed)
+      claimed.add(track.id)
+      tracks.append(track)
+    return tracks
+
+  def _observe(self, now, x, y, color, cnf, claimed=()):
+    track = self._find(x, y, claimed)
+    if track is None:
+      track = TrafficLightTrack(self.next_id, x, y, self._cell(x, y))
+      self.next_id += 1
+      self.tracks[track.id] = track
+      self.grid.setdefault(track.cell, []).append(track)
+      red = green = 0.0
+    else:
+      decay = math.exp(-(now - track.last_seen) / self.tau)
+      red, green = track.red * decay, track.green * decay
+      self._move(track, x, y)
+
+    # the same transitions the 2s detection history used to count, weighted by age
+    red_sum = green_sum = red_trig = green_trig = left_trig = 0.0
+    if color in _RED_COLORS:
+      red_trig = cnf * green
+      red_sum = cnf * (green + red)
+    elif color == "Green Light":
+      green_trig = cnf * red
+      green_sum = cnf * (green + red)
+    elif color == "Left turn":
+      left_trig = cnf * red
+      green_sum = cnf * green
+
+    if red_trig > 0:
+      track.state = TRAFFIC_RED
+    elif green_trig > 0 and green_sum > red_sum:
+      track.state = TRAFFIC_GREEN
+    elif left_trig > 0:
+      track.state = TRAFFIC_LEFT
+    elif red_sum > 0:
+      track.state = TRAFFIC_RED
+    elif green_sum > 0:
+      track.state = TRAFFIC_GREEN
+    else:
+      track.state = TRAFFIC_NONE
+
+    if color in _RED_COLORS:
+      red += 1.0
+    elif color in _GREEN_COLORS:
+      green += 1.0
+    track.red, track.green = red, green
+    track.color, track.cnf, track.last_seen = color, cnf, now
+    return track
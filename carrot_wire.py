@@ -0,0 +1,299 @@
+import collections
+import struct
+
+
+# Binary CarrotMan navigation packet (port 7706), sent instead of JSON by phone apps that support it.
+#
+#   header : magic "CRTB", version u8, sections u8 (bitmask), carrotIndex u32
+#   then, in bit order, one fixed-layout record per present section, each followed by its strings.
+#   strings: u16 length + utf-8 bytes
+#
+# Decoding yields the same keys/values as the JSON packet, so CarrotServ.update() handles both.
+# Packets not starting with the magic are treated as JSON (older phone apps).
+
+WIRE_MAGIC = b"CRTB"
+WIRE_VERSION = 1
+
+SECTION_NAV = 0x01
+SECTION_GOAL = 0x02
+SECTION_GPS = 0x04
+SECTION_CMD = 0x08
+SECTION_TIME = 0x10
+
+_HEADER = struct.Struct("<4sBBI")
+_STR_LEN = struct.Struct("<H")
+
+# section bit, record layout, numeric keys, string keys
+_SECTIONS = (
+  (SECTION_NAV, struct.Struct("<hhhhihhihhihhihihhihiiddff"), (
+    "nRoadLimitSpeed", "nSdiType", "nSdiSpeedLimit", "nSdiSection", "nSdiDist",
+    "nSdiBlockType", "nSdiBlockSpeed", "nSdiBlockDist",
+    "nSdiPlusType", "nSdiPlusSpeedLimit", "nSdiPlusDist",
+    "nSdiPlusBlockType", "nSdiPlusBlockSpeed", "nSdiPlusBlockDist", "roadcate",
+    "nTBTDist", "nTBTTurnType", "nTBTNextRoadWidth", "nTBTDistNext", "nTBTTurnTypeNext",
+    "nGoPosDist", "nGoPosTime",
+    "vpPosPointLat", "vpPosPointLon", "nPosAngle", "nPosSpeed",
+  ), ("szTBTMainText", "szNearDirName", "szFarDirName", "szPosRoadName")),
+  (SECTION_GOAL, struct.Struct("<dd"), ("goalPosX", "goalPosY"), ("szGoalName",)),
+  (SECTION_GPS, struct.Struct("<ddfff"), ("latitude", "longitude", "heading", "accuracy", "gps_speed"), ()),
+  (SECTION_CMD, struct.Struct("<"), (), ("carrotCmd", "carrotArg")),
+  (SECTION_TIME, struct.Struct("<q"), ("epochTime",), ("timezone",)),
+)
+
+
+def is_binary(data):
+  return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:4]) == WIRE_MAGIC
+
+
+def decode(data):
+  """Decode a binary packet into a JSON-equivalent dict. Raises ValueError on malformed input."""
+  try:
+    magic, version, sections, carrot_index = _HEADER.unpack_from(data, 0)
+    if magic != WIRE_MAGIC or version != WIRE_VERSION:
+      raise ValueError(f"unsupported carrot wire packet: {magic!r} v{version}")
+
+    packet = {"carrotIndex": carrot_index}
+    offset = _HEADER.size
+    for bit, record, keys, str_keys in _SECTIONS:
+      if not sections & bit:
+        continue
+      packet.update(zip(keys, record.unpack_from(data, offset), strict=True))
+      offset += record.size
+      for key in str_keys:
+        n, = _STR_LEN.unpack_from(data, offset)
+        offset += _STR_LEN.size
+        if offset + n > len(data):
+          raise ValueError(f"malformed carrot wire packet: {key} cut at {len(data)} bytes")
+        packet[key] = bytes(data[offset:offset + n]).decode("utf8")
+        offset += n
+    return packet
+  except (struct.error, UnicodeDecodeError) as e:
+    raise ValueError(f"malformed carrot wire packet: {e}") from e
+
+
+def encode(packet):
+  """Encode a JSON-style dict; a section is included when all of its numeric keys are present."""
+  sections = 0
+  body = []
+  for bit, record, keys, str_keys in _SECTIONS:
+    if not all(k in packet for k in keys) or not any(k in packet for k in keys + str_keys):
+      continue
+    sections |= bit
+    body.append(record.pack(*(packet[k] for k in keys)))
+    for key in str_keys:
+      raw = str(packet.get(key) or "").encode("utf8")
+      body.append(_STR_LEN.pack(len(raw)) + raw)
+  header = _HEADER.pack(WIRE_MAGIC, WIRE_VERSION, sections, int(packet.get("carrotIndex", 0)))
+  return header + b"".join(body)
+
+
+# Declarative field schema for packet ingestion.
+#   key: packet key, attr: CarrotServ attribute, type: target type,
+#   default: used when missing/null or malformed (KEEP = leave attribute unchanged),
+#   convert: optional callable applied after the cast (unit conversion, sentinel cleanup)
+KEEP = object()
+
+PacketField = collections.namedtuple("PacketField", ["key", "attr", "type", "default", "convert"], defaults=(None,))
+
+
+class FieldDecoder:
+  """Fills object attributes from a packet dict in one pass, counting missing keys and type errors per field."""
+  def __init__(self, fields):
+    self.fields = tuple(fields)
+    self._plan = tuple((i, f.key, f.attr, f.type, f.default, f.convert) for i, f in enumerate(self.fields))
+    self.missing = [0] * len(self.fields)
+    self.type_errors = [0] * len(self.fields)
+    self.packets = 0
+
+  def decode_into(self, obj, packet):
+    state = obj.__dict__
+    get = packet.get
+    missing = self.missing
+    type_errors = self.type_errors
+    self.packets += 1
+    for i, key, attr, typ, default, convert in self._plan:
+      value = get(key)
+      if value is None:
+        missing[i] += 1
+        value = default
+      elif type(value) is not typ:
+        try:
+          value = typ(value)
+        except (TypeError, ValueError):
+          type_errors[i] += 1
+          value = default
+      if value is KEEP:
+        continue
+      state[attr] = convert(value) if convert is not None else value
+
+  def stats(self):
+    return {f.attr: (self.missing[i], self.type_errors[i])
+            for i, f in enumerate(self.fields) if self.missing[i] or self.type_errors[i]}
+
+
+# Incremental (delta) mode of the navi feed.
+#   full snapshot : {"seq": n, ...all fields}
+#   delta         : {"seq": n, "delta": 1, ...changed fields only}, a null value removes the field
+# Packets without "seq" are legacy full packets and pass through untouched.
+SEQ_MOD = 1 << 16
+# one-shot keys: applied with the packet that carries them, never retained in the snapshot
+TRANSIENT_KEYS = frozenset(("carrotCmd", "carrotArg", "epochTime", "timezone",
+                            "latitude", "longitude", "heading", "accuracy", "gps_speed"))
+_SEQ_KEYS = frozenset(("seq", "delta"))
+
+
+class DeltaReceiver:
+  """Rebuilds full packets from deltas. On a sequence gap, deltas are dropped until the next full snapshot.
+
+  Nothing here can ask the sender for that snapshot; recovery waits for the next one it sends.
+
+  Returned packets carry no seq/delta keys, so they pass through apply() unchanged if applied again.
+  A null value removes the field from the snapshot, so readers fall back to their defaults. The
+  one-shot keys of a delta that cannot be merged (gap, late packet) are still delivered; only an
+  exact duplicate, whose keys were delivered with the original, is dropped as a whole.
+  """
+  def __init__(self):
+    self.state = {}
+    self.seq = -1
+    self.synced = False   # False after a gap until the next full snapshot
+    self.gaps = 0
+    self.dropped = 0
+
+  def apply(self, packet):
+    seq = packet.get("seq")
+    if seq is None:
+      return packet
+
+    seq = int(seq) % SEQ_MOD
+    if not packet.get("delta"):
+      self.state = {k: v for k, v in packet.items() if k not in TRANSIENT_KEYS and k not in _SEQ_KEYS and v is not None}
+      self.seq = seq
+      self.synced = True
+      return {k: v for k, v in packet.items() if k not in _SEQ_KEYS and v is not None}
+
+    step = (seq - self.seq) % SEQ_MOD
+    if self.synced and step != 1:
+      if step == 0:   # duplicate
+        self.dropped += 1
+        return None
+      if step > SEQ_MOD // 2:   # reordered late packet
+        self.dropped += 1
+        return self._transient(packet)
+      self.gaps += 1
+      self.synced = False
+    if not self.synced:
+      self.dropped += 1
+      return self._transient(packet)
+
+    self.seq = seq
+    state = self.state
+    for k, v in packet.items():
+      if k in TRANSIENT_KEYS or k in _SEQ_KEYS:
+        continue
+      if v is None:
+        state.pop(k, None)
+      else:
+        state[k] = v
+    full = dict(state)
+    full.update((k, v) for k, v in packet.items() if k in TRANSIENT_KEYS and v is not None)
+    return full
+
+  @staticmethod
+  def _transient(packet):
+    one_shot = {k: v for k, v in packet.items() if k in TRANSIENT_KEYS and v is not None}
+    return one_shot or None
+
+
+# carrotMan.naviPaths encodings.
+#   text    : "x,y,d;x,y,d;..." with 2 decimals (default)
+#   compact : NAVI_PATHS_COMPACT_PREFIX + polyline-encoded (x, y, d) deltas quantized to 0.01
+#             (Google encoded-polyline character scheme, 3 values per point)
+NAVI_PATHS_COMPACT_PREFIX = "@P1:"
+_NAVI_PATHS_SCALE = 100
+
+
+def encode_navi_paths(coords, distances):
+  return ";".join([f"{x:.2f},{y:.2f},{d:.2f}" for (x, y), d in zip(coords, distances, strict=False)])
+
+
+def encode_navi_paths_compact(coords, distances):
+  out = [NAVI_PATHS_COMPACT_PREFIX]
+  last = [0, 0, 0]
+  for (x, y), d in zip(coords, distances, strict=False):
+    for i, v in enumerate((x, y, d)):
+      q = int(round(v * _NAVI_PATHS_SCALE))
+      delta = q - last[i]
+      last[i] = q
+      delta = ~(delta << 1) if delta < 0 else delta << 1
+      while delta >= 0x20:
+        out.append(chr((0x20 | (delta & 0x1f)) + 63))
+        delta >>= 5
+      out.append(chr(delta + 63))
+  return "".join(out)
+
+
+def decode_navi_paths_compact(text):
+  """Returns [(x, y, d), ...]."""
+  values = []
+  acc = shift = 0
+  for ch in text[len(NAVI_PATHS_COMPACT_PREFIX):]:
+    b = ord(ch) - 63
+    acc |= (b & 0x1f) << shift
+    shift += 5
+    if b < 0x20:
+      values.append(~(acc >> 1) if acc & 1 else acc >> 1)
+      acc = shift = 0
+  points = []
+  last = [0, 0, 0]
+  for i in range(0, len(values) - 2, 3):
+    for j in range(3):
+      last[j] += values[i + j]
+    points.append((last[0] / _NAVI_PATHS_SCALE, last[1] / _NAVI_PATHS_SCALE, last[2] / _NAVI_PATHS_SCALE))
+  return points
+
+
+class LatestMailbox:
+  """Hands decoded packets from the UDP receiver thread to the navigation tick without a lock.
+
+  deque append/popleft are atomic, so the receiver only appends and the tick takes everything
+  posted since its last take. State keys are coalesced into the newest packet (newer keys win);
+  one-shot keys (TRANSIENT_KEYS: commands, phone fixes) of the older packets are kept as packets of
+  their own, in order, so two commands in one burst are both applied.
+  """
+  def __init__(self, maxlen=32):
+    self._q = collections.deque(maxlen=maxlen)
+    self.posted = 0
+    self.dropped = 0     # overflowed before the tick took them
+    self.coalesced = 0   # merged into a newer packet
+
+  def post(self, packet):
+    if len(self._q) == self._q.maxlen:
+      self.dropped += 1
+    self._q.append(packet)
+    self.posted += 1
+
+  def take(self):
+    """Returns the packets to apply, oldest first; empty if nothing was posted."""
+    q = self._q
+    if not q:
+      return []
+    packet = q.popleft()
+    if not q:
+      return [packet]
+    packets = []
+    state = {}
+    while True:
+      one_shot = {k: v for k, v in packet.items() if k in TRANSIENT_KEYS}
+      if one_shot:
+        # the index the phone sent them with: carrotCmdIndex and the time sync are keyed on it
+        if "carrotIndex" in packet:
+          one_shot["carrotIndex"] = packet["carrotIndex"]
+        packets.append(one_shot)
+      state.update((k, v) for k, v in packet.items() if k not in TRANSIENT_KEYS)
+      self.coalesced += 1
+      packet = q.popleft()
+      if not q:
+        break
+    state.update(packet)
+    packets.append(state)
+    return packets
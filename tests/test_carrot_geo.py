@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.carrot.carrot_geo import DATUM_GCJ02, EARTH_RADIUS, DatumConverter, DeadReckoner, GpsFusion, LocalFrame, \
+                                                  angle_diff, dead_reckon, destination, destination_point, gcj02_to_wgs84, haversine, \
+                                                  initial_bearing, project, wgs84_to_gcj02
+from openpilot.selfdrive.carrot.carrot_serv import gps_accuracy, GPS_ACCURACY_MIN, GPS_ACCURACY_UNKNOWN
+
+
+def test_missing_accuracy_is_not_trusted():
+  assert gps_accuracy(0.0) == GPS_ACCURACY_UNKNOWN
+  assert gps_accuracy(-1.0) == GPS_ACCURACY_UNKNOWN
+  assert gps_accuracy(math.nan) == GPS_ACCURACY_UNKNOWN
+  assert gps_accuracy(1.0) == GPS_ACCURACY_MIN
+  assert gps_accuracy(8.0) == 8.0
+
+
+def test_dead_reckoner_straight_and_turning():
+  dr = DeadReckoner()
+  dr.fix(37.5, 127.0, 0.0)
+  lat, lon, heading = dr.step(10.0, 10.0, 0.0)
+  assert haversine(37.5, 127.0, lat, lon) == pytest.approx(100.0, rel=1e-3) and lon == 127.0
+
+  # a quarter circle to the right at 10 m/s and 9 deg/s ends up 10 s later heading east
+  dr.fix(37.5, 127.0, 0.0)
+  for k in range(1, 101):
+    lat, lon, heading = dr.step(k * 0.1, 10.0, 0.0, -math.radians(9.0))
+  assert heading == pytest.approx(90.0)
+  e, n = LocalFrame(37.5, 127.0).to_enu(lat, lon)
+  radius = 10.0 / math.radians(9.0)
+  assert e == pytest.approx(radius, rel=0.02) and n == pytest.approx(radius, rel=0.02)
+
+
+def test_dead_reckon_batch_matches_steps():
+  dt, speed, yaw_rate = np.full(20, 0.05), np.linspace(10.0, 12.0, 20), np.full(20, 0.1)
+  lat, lon, heading = dead_reckon(37.5, 127.0, 45.0, dt, speed, yaw_rate)
+  dr = DeadReckoner()
+  dr.fix(37.5, 127.0, 0.0)
+  steps = [dr.step((k + 1) * 0.05, speed[k], 45.0, 0.1) for k in range(20)]
+  np.testing.assert_allclose(np.c_[lat, lon, heading], steps, rtol=0, atol=1e-9)
+
+
+def test_fusion_weighs_accuracy_and_gates_outliers():
+  fusion = GpsFusion(max_rejects=2)
+  fusion.update(0.0, 37.5, 127.0, 10.0)
+  lat, lon = destination(37.5, 127.0, 10.0, 0.0)
+  assert fusion.update(0.0, lat, lon, 2.0)
+  assert fusion.n == pytest.approx(10.0 * 100.0 / 104.0)
+
+  far_lat, far_lon = destination(37.5, 127.0, 500.0, 90.0)
+  assert not fusion.update(0.0, far_lat, far_lon, 3.0)
+  assert not fusion.update(0.0, far_lat, far_lon, 3.0)
+  assert fusion.update(0.0, far_lat, far_lon, 3.0)   # a real jump is taken after max_rejects
+  assert fusion.e == pytest.approx(500.0, rel=1e-3) and fusion.rejects == 0
+
+
+def test_geodesy_known_values():
+  assert haversine(0.0, 0.0, 1.0, 0.0) == pytest.approx(EARTH_RADIUS * math.pi / 180.0)
+  assert initial_bearing(0.0, 0.0, 0.0, 1.0) == pytest.approx(90.0)
+  assert initial_bearing(37.5, 127.0, 37.4, 127.0) == pytest.approx(180.0)
+  assert float(angle_diff(350.0, 10.0)) == -20.0
+
+
+def test_geodesy_batches_match_scalars():
+  rng = np.random.default_rng(0)
+  lat, lon = 37.5 + rng.uniform(-0.5, 0.5, 50), 127.0 + rng.uniform(-0.5, 0.5, 50)
+  dist, bearing = rng.uniform(10.0, 5000.0, 50), rng.uniform(0.0, 360.0, 50)
+  lat2, lon2 = destination_point(lat, lon, dist, bearing)
+  np.testing.assert_allclose(haversine(lat, lon, lat2, lon2), dist, rtol=1e-9)
+  np.testing.assert_allclose(angle_diff(initial_bearing(lat, lon, lat2, lon2), bearing), 0.0, atol=1e-6)
+  assert float(haversine(lat[3], lon[3], lat2[3], lon2[3])) == pytest.approx(dist[3])
+
+  e, n = project(lat2, lon2, 37.5, 127.0)
+  frame = LocalFrame(37.5, 127.0)
+  assert (e[7], n[7]) == frame.to_enu(lat2[7], lon2[7])
+  e32, _ = project(lat2, lon2, 37.5, 127.0, dtype=np.float32)
+  assert e32.dtype == np.float32
+  np.testing.assert_allclose(e32, e, atol=0.01)
+
+
+def test_gcj02_offset_and_round_trip():
+  lat, lon = 39.9042, 116.4074   # Beijing
+  g_lat, g_lon = wgs84_to_gcj02(lat, lon)
+  assert 100.0 < haversine(lat, lon, g_lat, g_lon) < 1000.0
+  w_lat, w_lon = gcj02_to_wgs84(g_lat, g_lon)
+  assert haversine(lat, lon, w_lat, w_lon) < 0.05
+  assert wgs84_to_gcj02(35.68, 139.76) == (35.68, 139.76)   # Tokyo, outside China
+
+
+def test_gcj02_arrays_match_scalars():
+  lat = np.array([39.9042, 31.2304, 22.5431, 35.68])
+  lon = np.array([116.4074, 121.4737, 114.0579, 139.76])
+  g_lat, g_lon = wgs84_to_gcj02(lat, lon)
+  w_lat, w_lon = gcj02_to_wgs84(g_lat, g_lon)
+  for k in range(len(lat)):
+    assert (g_lat[k], g_lon[k]) == pytest.approx(wgs84_to_gcj02(float(lat[k]), float(lon[k])), abs=1e-12)
+    assert (w_lat[k], w_lon[k]) == pytest.approx(gcj02_to_wgs84(float(g_lat[k]), float(g_lon[k])), abs=1e-12)
+
+
+def test_datum_converter():
+  gcj = DatumConverter(DATUM_GCJ02)
+  assert gcj.point(0.0, 0.0) == (0.0, 0.0)
+  assert DatumConverter().point(39.9, 116.4) == (39.9, 116.4)
+  path = [wgs84_to_gcj02(39.9042, 116.4074), wgs84_to_gcj02(39.91, 116.41)]
+  out = gcj.path(path)
+  assert gcj.path(path) is out and gcj.path(list(path)) is out
+  np.testing.assert_allclose(out, [[39.9042, 116.4074], [39.91, 116.41]], atol=1e-6)
+  with pytest.raises(ValueError):
+    DatumConverter("bd09")
@@ -0,0 +1,23 @@
+from openpilot.selfdrive.carrot.carrot_hazard import HazardQueue, HAZARD_CAMERA, HAZARD_SECTION
+
+
+def test_upcoming_stops_at_horizon():
+  hq = HazardQueue()
+  for i in range(200):
+    hq.upsert(HAZARD_CAMERA, i, 100.0 + i * 500.0, 50.0)
+  hq.commit()
+  assert [round(d) for d, _ in hq.upcoming(1200.0)] == [100, 600, 1100]
+  hq.advance(700.0)
+  assert [round(d) for d, _ in hq.upcoming(1200.0)] == [400, 900]
+  assert len(hq.entries) == 198
+
+
+def test_section_zone_applies_until_its_end():
+  hq = HazardQueue()
+  hq.upsert(HAZARD_SECTION, 4, 3000.0, 80.0)
+  hq.commit()
+  assert hq.upcoming(1000.0) == []
+  hq.advance(2900.0)
+  assert [h.speed for h in hq.active_zones()] == [80.0]
+  hq.advance(200.0)
+  assert hq.active_zones() == []
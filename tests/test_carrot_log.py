@@ -0,0 +1,25 @@
+import io
+
+from openpilot.selfdrive.carrot.carrot_log import CarrotLog
+
+
+def test_rate_limit_only_applies_to_the_flush():
+  out = io.StringIO()
+  log = CarrotLog(capacity=8, flush_interval=60.0, out=out)
+  log.set_rate("navi", 60.0)
+  log.log("navi", "speed {}", 1)
+  log.log("navi", "speed {}", 2)
+  log.log("cmd", "{} {}", "DETECT")   # a bad format is kept with its args
+  log.flush()
+  lines = out.getvalue().splitlines()
+  assert len(lines) == 2 and lines[0].endswith("[navi] speed 1") and "[cmd] {} {} ('DETECT',)" in lines[1]
+  assert log.suppressed["navi"] == 1
+  assert [line.split(" ", 1)[1] for line in log.dump()] == ["[navi] speed 1", "[navi] speed 2", "[cmd] {} {} ('DETECT',)"]
+  assert log.dump(seconds=-1.0) == []
+
+
+def test_ring_keeps_the_latest_entries():
+  log = CarrotLog(capacity=3, flush_interval=60.0, out=io.StringIO())
+  for k in range(5):
+    log.log("k", "{}", k)
+  assert [line.rsplit(" ", 1)[1] for line in log.dump()] == ["2", "3", "4"]
@@ -0,0 +1,17 @@
+import os
+import time
+
+from openpilot.selfdrive.carrot.carrot_params import ParamsWatcher
+
+
+def test_watcher_bumps_on_mtime_change_and_stops(tmp_path):
+  watcher = ParamsWatcher([str(tmp_path), None], interval=0.01)
+  assert watcher.version == 0 and watcher.paths == [str(tmp_path)]
+  st = os.stat(tmp_path)
+  os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+  deadline = time.monotonic() + 2.0
+  while watcher.version == 0 and time.monotonic() < deadline:
+    time.sleep(0.01)
+  assert watcher.version == 1
+  watcher.stop()
+  assert not watcher._thread.is_alive()
@@ -0,0 +1,60 @@
+import collections
+import sqlite3
+import time
+
+from openpilot.selfdrive.carrot.carrot_phase import PhaseStats, PhaseStore, TrafficPhasePredictor
+from openpilot.selfdrive.carrot.carrot_traffic import TRAFFIC_GREEN, TRAFFIC_RED
+
+
+class RecordingStore:
+  def __init__(self):
+    self.results = collections.deque()
+    self.posts = []
+
+  def fetch(self, key):
+    self.posts.append(("get", key))
+
+  def touch(self, key):
+    self.posts.append(("touch", key))
+
+  def save(self, key, stats):
+    self.posts.append(("put", key))
+
+
+def test_no_fix_keys_nothing():
+  store = RecordingStore()
+  tp = TrafficPhasePredictor(store)
+  tp.update(0.0, 0.0, 0.0, 90.0, TRAFFIC_RED)
+  tp.update(20.0, 0.0, 0.0, 90.0, TRAFFIC_GREEN)
+  assert store.posts == []
+  assert tp.key is None and tp.predict(20.0) == -1.0
+
+
+def test_learns_red_and_touches_cached_key():
+  store = RecordingStore()
+  tp = TrafficPhasePredictor(store)
+  tp.update(0.0, 37.5, 127.0, 90.0, TRAFFIC_GREEN)
+  tp.update(1.0, 37.5, 127.0, 90.0, TRAFFIC_RED)
+  store.results.append((tp.key, PhaseStats()))
+  tp.update(31.0, 37.5, 127.0, 90.0, TRAFFIC_GREEN)
+  assert [p[0] for p in store.posts] == ["get", "put"]
+
+  tp.update(32.0, 37.5, 127.0, 90.0, TRAFFIC_RED)
+  assert store.posts[-1] == ("touch", tp.key)
+  assert tp.predict(42.0) == 20.0
+
+
+def test_store_read_refreshes_last_used(tmp_path):
+  path = str(tmp_path / "phase.db")
+  store = PhaseStore(path)
+  store.save("k", PhaseStats(1, 30.0))
+  store.fetch("k")
+  while not store.results:
+    time.sleep(0.01)
+  written = sqlite3.connect(path).execute("SELECT last_used FROM phases WHERE key = 'k'").fetchone()[0]
+  time.sleep(0.02)
+  store.fetch("k")
+  while len(store.results) < 2:
+    time.sleep(0.01)
+  time.sleep(0.05)
+  assert sqlite3.connect(path).execute("SELECT last_used FROM phases WHERE key = 'k'").fetchone()[0] > written
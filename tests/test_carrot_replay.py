@@ -0,0 +1,14 @@
+from openpilot.selfdrive.carrot.carrot_replay import CarrotRecorder, load
+
+
+def test_load_unclosed_recording(tmp_path):
+  path = str(tmp_path / "drive.jsonl.gz")
+  recorder = CarrotRecorder(path)
+  for i in range(250):
+    recorder.record_packet(i * 0.1, {"carrotIndex": i})
+  # carrot_man killed: no close(), only the periodic flushes reached the file
+  records = load(path)
+  assert len(records) == 200
+  assert [r["d"]["carrotIndex"] for r in records] == list(range(200))
+  recorder.close()
+  assert len(load(path)) == 250
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.carrot.carrot_route import MapMatcher, RouteSpeed
+
+
+def corner(step, leg=200.0):
+  """A 90 degree corner at the origin with points `step` [m] apart."""
+  a = np.arange(0.0, leg + step, step)
+  xy = np.r_[np.c_[np.zeros(len(a)), -a[::-1]], np.c_[a[1:], np.zeros(len(a) - 1)]]
+  s = np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]
+  return xy, s
+
+
+@pytest.mark.parametrize("step", [5.0, 10.0, 20.0, 30.0, 50.0])
+def test_corner_slows_down_at_any_spacing(step):
+  xy, s = corner(step)
+  speeds = RouteSpeed(xy, s, 1.0)
+  assert speeds.min_speed(0.0, s[-1]) < 40.0
+
+
+def test_straight_route_is_not_limited():
+  xy = np.c_[np.arange(0.0, 500.0, 25.0), np.zeros(20)]
+  speeds = RouteSpeed(xy, xy[:, 0], 1.0)
+  assert speeds.min_speed(0.0, 500.0) > 200.0
+
+
+def test_matcher_grid_follows_long_diagonal_segment():
+  xy = np.r_[np.c_[np.arange(200) * 5.0, np.zeros(200)], [[995.0 + 4000.0, 4000.0]]]
+  s = np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]
+  matcher = MapMatcher(xy, s)
+  # a corridor, not the 4 km x 4 km bounding box of the last segment
+  assert len(matcher.grid) < 1000
+
+  rng = np.random.default_rng(0)
+  for x, y in zip(rng.uniform(-50.0, 5050.0, 2000), rng.uniform(-50.0, 4050.0, 2000), strict=True):
+    t = np.clip(((x - matcher.a[:, 0]) * matcher.d[:, 0] + (y - matcher.a[:, 1]) * matcher.d[:, 1]) / matcher.len2, 0.0, 1.0)
+    near = (np.hypot(matcher.a[:, 0] + t * matcher.d[:, 0] - x, matcher.a[:, 1] + t * matcher.d[:, 1] - y) <= matcher.max_dist).any()
+    assert (matcher.match(x, y, 0.0)[1] >= 0.0) == near
+
+
+def test_serv_keeps_route_state_for_an_equal_route():
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ
+  serv = CarrotServ()
+  coords, distances = [(0.0, 0.0), (10.0, 0.0), (20.0, 0.0)], [0.0, 10.0, 20.0]
+  serv._update_route(coords, distances, 0.0)
+  serv._update_route(coords, distances, 5.0)
+  serv._update_route(list(coords), list(distances), 5.0)
+  assert serv.route_revision == 1 and serv.route_s == 10.0
+  serv._update_route(coords[:2], distances[:2], 5.0)
+  serv.close()
+  assert serv.route_revision == 2 and serv.route_s == 0.0
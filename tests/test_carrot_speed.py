@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.carrot.carrot_speed import SpeedArbiter, SpeedProfile, SpeedTrace
+
+
+def test_trace_keeps_the_binding_row_on_overflow():
+  arbiter = SpeedArbiter(capacity=4)
+  for k in range(6):
+    arbiter.add_speed(100.0 - k, f"s{k}")
+  speed, source = arbiter.solve()
+  trace = SpeedTrace(capacity=8, max_rows=4)
+  trace.record(0.0, 50.0, arbiter, source, speed, source, 0.0, False)
+  snap = trace.snapshot()
+  assert snap["rows"][0] == 4 and snap["dropped"][0] == 2
+  assert snap["speeds"][0, 3] == 95.0
+  assert snap["sources"][snap["row_sources"][0, 3]] == "s5"
+  assert snap["sources"][snap["winner"][0]] == "s5"
+
+
+def test_profile_respects_accel_and_jerk_limits():
+  arbiter = SpeedArbiter()
+  arbiter.add_speed(30.0, "road")
+  profile = SpeedProfile()
+  speeds = profile.update(0.0, 0.0, 25.0, arbiter)
+  assert speeds[0] == pytest.approx(90.0)
+  a = np.diff(profile._v) / profile.step
+  assert a.min() >= profile.a_min - 1e-9 and a.max() <= profile.a_max + 1e-9
+  assert np.abs(np.diff(a)).max() <= profile.j_max * profile.step + 1e-9
+  assert speeds[-1] == pytest.approx(30.0, abs=2.0)
+
+
+def test_profile_is_shifted_until_a_row_moves():
+  arbiter = SpeedArbiter()
+  arbiter.add(200.0, 30.0, 2.0, 1.0, "cam")
+  profile = SpeedProfile()
+  first = profile.update(0.0, 0.0, 20.0, arbiter).copy()
+  arbiter.dist[0] = 190.0   # 10 m driven, the camera stays where it was
+  shifted = profile.update(0.5, 10.0, float(np.interp(0.5, profile._t, profile._v)), arbiter)
+  assert profile.recomputes == 1
+  assert shifted[0] == pytest.approx(first[1])
+  arbiter.dist[0] = 300.0
+  profile.update(1.0, 20.0, shifted[1] / 3.6, arbiter)
+  assert profile.recomputes == 2
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.carrot.carrot_traffic import TrafficLightTracker, parse_detect, TRAFFIC_COLOR_CODES, \
+                                                      TRAFFIC_GREEN, TRAFFIC_NONE, TRAFFIC_RED
+
+
+def test_tracker_follows_red_to_green_on_one_light():
+  tracker = TrafficLightTracker()
+  assert tracker.observe(0.0, 0.5, 0.4, "Red Light", 0.8).state == TRAFFIC_NONE
+  track = tracker.observe(0.1, 0.52, 0.4, "Red Light", 0.8)
+  assert track.state == TRAFFIC_RED
+  assert tracker.observe(0.2, 0.51, 0.41, "Green Light", 0.9) is track
+  assert track.state == TRAFFIC_GREEN
+  assert len(tracker.tracks) == 1
+
+
+def test_tracker_keeps_lights_apart_and_expires_them():
+  tracker = TrafficLightTracker()
+  left = tracker.observe(0.0, 0.2, 0.4, "Red Light", 0.8)
+  right = tracker.observe(0.0, 0.8, 0.4, "Green Light", 0.8)
+  assert left is not right
+  tracker.observe(1.0, 0.8, 0.4, "Green Light", 0.8)
+  tracker.expire(2.5)
+  assert list(tracker.tracks) == [right.id]
+  tracker.expire(3.5)
+  assert tracker.tracks == {} and tracker.grid == {}
+
+
+def test_parse_detect_formats():
+  assert parse_detect("Red Light, 0.5, 0.4, 0.8")[0] is None
+  frame_id, boxes = parse_detect("1234|Red Light,0.5,0.4,0.8;Left turn,0.6,0.4,0.7;")
+  assert frame_id == 1234
+  np.testing.assert_allclose(boxes, [[TRAFFIC_COLOR_CODES["Red Light"], 0.5, 0.4, 0.8],
+                                     [TRAFFIC_COLOR_CODES["Left turn"], 0.6, 0.4, 0.7]])
+  assert parse_detect("7|")[1].shape == (0, 4)
+  with pytest.raises(ValueError):
+    parse_detect("Red Light,0.5")
+
+
+def test_batch_gives_each_track_at_most_one_box():
+  tracker = TrafficLightTracker()
+  _, boxes = parse_detect("1|Red Light,0.50,0.4,0.6;Red Light,0.55,0.4,0.9")
+  high, low = tracker.observe_batch(0.0, boxes)
+  assert (high.cnf, low.cnf) == (0.9, 0.6) and high is not low
+  high2, low2 = tracker.observe_batch(0.1, boxes)
+  assert high2 is high and low2 is low and len(tracker.tracks) == 2
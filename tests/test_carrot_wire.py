@@ -0,0 +1,83 @@
+import pytest
+
+from openpilot.selfdrive.carrot.carrot_wire import DeltaReceiver, LatestMailbox, decode, encode, is_binary
+
+
+def test_null_clears_the_field():
+  rx = DeltaReceiver()
+  rx.apply({"seq": 0, "goalPosX": 127.0, "nRoadLimitSpeed": 80})
+  full = rx.apply({"seq": 1, "delta": 1, "goalPosX": None})
+  assert full == {"nRoadLimitSpeed": 80}
+
+
+def test_one_shot_keys_survive_a_gap():
+  rx = DeltaReceiver()
+  rx.apply({"seq": 0, "nRoadLimitSpeed": 80})
+  assert rx.apply({"seq": 1, "delta": 1, "carrotCmd": "SPEED"})["carrotCmd"] == "SPEED"
+  # a duplicate was delivered with the original
+  assert rx.apply({"seq": 1, "delta": 1, "carrotCmd": "SPEED"}) is None
+  packet = rx.apply({"seq": 5, "delta": 1, "nRoadLimitSpeed": 60, "carrotCmd": "DETECT", "carrotArg": "Red Light,0.5,0.4,0.8"})
+  assert packet == {"carrotCmd": "DETECT", "carrotArg": "Red Light,0.5,0.4,0.8"}
+  assert not rx.synced
+
+
+def test_gap_drops_deltas_until_full_snapshot():
+  rx = DeltaReceiver()
+  rx.apply({"seq": 0, "nRoadLimitSpeed": 80, "goalPosX": 127.0})
+  assert rx.apply({"seq": 1, "delta": 1, "nRoadLimitSpeed": 70}) == {"nRoadLimitSpeed": 70, "goalPosX": 127.0}
+  assert rx.apply({"seq": 3, "delta": 1, "nRoadLimitSpeed": 60}) is None
+  assert rx.apply({"seq": 4, "delta": 1, "nRoadLimitSpeed": 50}) is None
+  assert rx.gaps == 1 and rx.dropped == 2 and not rx.synced
+  assert rx.apply({"seq": 5, "nRoadLimitSpeed": 40}) == {"nRoadLimitSpeed": 40}
+  assert rx.synced
+  assert rx.apply({"seq": 6, "delta": 1, "goalPosX": 126.0}) == {"nRoadLimitSpeed": 40, "goalPosX": 126.0}
+  assert rx.gaps == 1 and rx.dropped == 2
+
+
+def test_null_through_carrot_serv():
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ
+  serv = CarrotServ()
+  serv.update({"seq": 0, "goalPosX": 127.0, "goalPosY": 37.5, "nRoadLimitSpeed": 80})
+  serv.update({"seq": 1, "delta": 1, "goalPosX": None, "goalPosY": None, "nRoadLimitSpeed": None})
+  serv.close()
+  assert serv.goalPosX == 127.0
+
+
+def test_mailbox_queues_commands_and_coalesces_state():
+  mailbox = LatestMailbox()
+  mailbox.post({"nRoadLimitSpeed": 80, "carrotCmd": "DETECT", "carrotArg": "a"})
+  mailbox.post({"nRoadLimitSpeed": 60, "nSdiType": 1})
+  mailbox.post({"nRoadLimitSpeed": 50, "carrotCmd": "DETECT", "carrotArg": "b"})
+  assert mailbox.take() == [
+    {"carrotCmd": "DETECT", "carrotArg": "a"},
+    {"nRoadLimitSpeed": 50, "nSdiType": 1, "carrotCmd": "DETECT", "carrotArg": "b"},
+  ]
+  assert mailbox.take() == []
+
+
+def test_command_keeps_its_carrot_index_within_one_tick():
+  from openpilot.selfdrive.carrot.carrot_serv import CarrotServ
+  serv = CarrotServ()
+  serv.navi_mailbox.post({"carrotIndex": 10, "carrotCmd": "DETECT", "carrotArg": "Red Light,0.5,0.4,0.8"})
+  serv.navi_mailbox.post({"carrotIndex": 11, "nRoadLimitSpeed": 80})
+  for packet in serv.navi_mailbox.take():
+    serv.update(packet)
+  serv.close()
+  assert serv.carrotCmdIndex == 10
+  assert serv.carrotIndex == 11
+
+
+def test_binary_round_trip():
+  packet = {"carrotIndex": 7, "goalPosX": 127.5, "goalPosY": 37.25, "szGoalName": "서울역",
+            "latitude": 37.5, "longitude": 127.0, "heading": 90.0, "accuracy": 4.0, "gps_speed": 12.5,
+            "carrotCmd": "DETECT", "carrotArg": "Red Light,1,2,0.9"}
+  data = encode(packet)
+  assert is_binary(data) and not is_binary(b'{"carrotIndex": 7}')
+  assert decode(data) == packet
+
+
+def test_binary_truncated_packet_raises():
+  data = encode({"carrotIndex": 1, "goalPosX": 127.5, "goalPosY": 37.25, "szGoalName": "goal"})
+  for n in (3, 9, len(data) - 8, len(data) - 2):
+    with pytest.raises(ValueError):
+      decode(data[:n])
@@ -10,6 +10,7 @@ from flask import Flask, render_template_string, request, jsonify, send_file, re
 from functools import wraps
 from openpilot.system.hardware import PC
 from selfdrive.carrot.xiaoge_sentryd import SentryDB, MEDIA_DIR
+from selfdrive.carrot.carrot_speed import SPEED_TRACE_PATH
 
 # ============ 日志配置 ============
 logging.basicConfig(
@@ -855,6 +856,14 @@ def serve_media(filename):
         logger.error(f"Error serving media file {filename} from {request.remote_addr}: {e}")
         return jsonify({'status': 'error', 'message': 'Failed to serve file'}), 500
 
+@app.route('/api/speed_trace')
+@login_required
+def serve_speed_trace():
+    """carrot 速度决策记录 (SpeedTrace.dump 生成的 .npz)"""
+    if not os.path.exists(SPEED_TRACE_PATH):
+        return jsonify({'status': 'error', 'message': 'No speed trace, send SIGUSR1 to carrot_man first'}), 404
+    return send_file(SPEED_TRACE_PATH, mimetype='application/octet-stream', as_attachment=True)
+
 @app.route('/api/delete/<int:event_id>', methods=['DELETE'])
 @login_required
 def delete_event(event_id):